@@ -1,14 +1,30 @@
 import streamlit as st
 import google.generativeai as genai
+import asyncio
 import json
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+from functools import partial
 import base64
 import time
+import uuid
+
+from prompts import build_prompt, parse_json_response, load_reference_text
+from gemini_cache import GeminiCacheBackend, PromptCache
+from check_models import load_ranked_model
+from async_gemini import AsyncGeminiClient, AsyncRunner, describe_error
+import shared_path  # noqa: F401
+from citation_index import PLACEHOLDERS, STATUS_LABELS, load_default_index
+from history_store import HistoryStore, history_to_parquet_bytes, history_to_record
+from profiling import Profiler, stage
+from self_consistency import (DEFAULT_SAMPLES, DEFAULT_TEMPERATURE, SAMPLE_OPTIONS, aggregate, consistency_caption,
+                              sample_parallel)
 
 # 設定読み込み
 load_dotenv()
+profiler = Profiler.from_env()
+citation_index = load_default_index()
 
 # ==========================================
 # 📁 パス設定
@@ -37,6 +53,10 @@ if 'current_result' not in st.session_state:
     st.session_state.current_result = None
 if 'current_input' not in st.session_state:
     st.session_state.current_input = ""
+if 'last_usage' not in st.session_state:
+    st.session_state.last_usage = None
+if 'num_samples' not in st.session_state:
+    st.session_state.num_samples = DEFAULT_SAMPLES
 
 # ==========================================
 # 🎨 CSSデザイン
@@ -166,6 +186,12 @@ st.markdown("""
         font-weight: 600;
         margin: 0 6px 6px 0;
     }
+
+    .law-tag-unknown {
+        background-color: #fef2f2;
+        color: #b91c1c;
+        border: 1px dashed #fca5a5;
+    }
     </style>
 """, unsafe_allow_html=True)
 
@@ -207,42 +233,145 @@ def render_sidebar_label(text, icon=""):
 # 🤖 Gemini API設定
 # ==========================================
 
+DEFAULT_MODEL = 'gemini-2.5-flash'
+GENERATION_CONFIG = dict(temperature=0.3, max_output_tokens=4000)
+# Self-consistency（複数候補の多数決）で候補を生成するときの設定
+SAMPLING_CONFIG = dict(GENERATION_CONFIG, temperature=DEFAULT_TEMPERATURE)
+
+@st.cache_resource
+def select_model_name():
+    """
+    使用するモデル名を決定（チューニング済みモデル > check_models.py のランキング > 既定値）
+    再実行のたびにランキングを読み直さないよう、プロセスで1回だけ決定する
+    """
+    tuned_model_id = os.environ.get("TUNED_MODEL_ID")
+    return tuned_model_id or load_ranked_model() or DEFAULT_MODEL
+
 @st.cache_resource
 def initialize_gemini():
     api_key = os.environ.get("GOOGLE_API_KEY")
-    tuned_model_id = os.environ.get("TUNED_MODEL_ID")
     if not api_key: return None
     
-    target_model = tuned_model_id if tuned_model_id else 'gemini-2.5-flash'
+    target_model = select_model_name()
     genai.configure(api_key=api_key)
     return genai.GenerativeModel(
         target_model, 
-        generation_config=genai.types.GenerationConfig(temperature=0.3, max_output_tokens=4000)
+        generation_config=genai.types.GenerationConfig(**GENERATION_CONFIG)
     )
 
-def call_gemini_api(model, input_text):
-    prompt = f"""
-    あなたは「Guardian AI」という高度な法務リスク診断システムです。
-    以下の仕様の法的リスクを厳格に診断してください。
-    
-    【仕様】
-    {input_text}
-    
-    【出力形式(JSON)】
-    {{
-        "risk_level": "High/Medium/Low",
-        "summary": "履歴表示用の一言サマリー（20文字以内）",
-        "laws": ["関連法1", "関連法2"],
-        "reason": "詳細な理由（専門的な観点から）",
-        "recommendations": ["推奨事項1", "推奨事項2", "推奨事項3"]
-    }}
+@st.cache_resource
+def initialize_prompt_cache():
+    """
+    固定プリアンブル用の Context Cache を準備する。
+    GEMINI_CONTEXT_CACHE=1 のときのみ有効（チューニング済みモデルはキャッシュ非対応）。
+    """
+    if os.environ.get("GEMINI_CONTEXT_CACHE") != "1" or os.environ.get("TUNED_MODEL_ID"):
+        return None
+    backend = GeminiCacheBackend(
+        select_model_name(), generation_config=genai.types.GenerationConfig(**GENERATION_CONFIG)
+    )
+    return PromptCache(
+        backend,
+        reference_text=load_reference_text(),
+        ttl_seconds=int(os.environ.get("GEMINI_CACHE_TTL", "3600")),
+    )
+
+@st.cache_resource
+def initialize_async_client():
+    """
+    GEMINI_ASYNC=1 のとき、全セッションで共有する非同期クライアントを準備する。
+    GEMINI_HEDGE=1 で p95 を超えた応答に対するヘッジリクエストを有効化。
+    """
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if os.environ.get("GEMINI_ASYNC") != "1" or not api_key:
+        return None
+    client = AsyncGeminiClient(
+        api_key,
+        select_model_name(),
+        generation_config={"temperature": 0.3, "maxOutputTokens": 4000},
+        timeout=float(os.environ.get("GEMINI_TIMEOUT", "60")),
+        hedge=os.environ.get("GEMINI_HEDGE") == "1",
+    )
+    return AsyncRunner(), client
+
+@st.cache_resource
+def initialize_history_store():
+    """GUARDIAN_HISTORY_DIR が設定されている場合のみ、診断履歴を Parquet に追記するストアを返す"""
+    root = os.environ.get("GUARDIAN_HISTORY_DIR")
+    return HistoryStore(root) if root else None
+
+def sample_gemini_candidates(model, input_text, num_samples, prompt_cache=None, async_client=None):
     """
+    num_samples 件の候補を並行リクエストで生成し、多数決で1つにまとめる
+    （待ち時間は逐次 k 回ではなく、最も遅い1件分程度になる）
+    """
+    with stage("api_call"):
+        if async_client:
+            runner, client = async_client
+            prompt = build_prompt(input_text, load_reference_text())
+            config = {"temperature": SAMPLING_CONFIG["temperature"], "maxOutputTokens": SAMPLING_CONFIG["max_output_tokens"]}
+
+            async def gather():
+                return await asyncio.gather(
+                    *(client.generate(prompt, generation_config=config) for _ in range(num_samples)),
+                    return_exceptions=True,
+                )
+
+            outputs = runner.run(gather())
+            texts = [o for o in outputs if not isinstance(o, BaseException)]
+            errors = [o for o in outputs if isinstance(o, BaseException)]
+        elif prompt_cache:
+            config = genai.types.GenerationConfig(**SAMPLING_CONFIG)
+            results, errors = sample_parallel(lambda: prompt_cache.generate(input_text, config), num_samples)
+            texts = [text for text, _ in results]
+            if results:
+                st.session_state.last_usage = results[0][1]
+        else:
+            prompt = build_prompt(input_text, load_reference_text())
+            config = genai.types.GenerationConfig(**SAMPLING_CONFIG)
+            texts, errors = sample_parallel(lambda: model.generate_content(prompt, generation_config=config).text, num_samples)
+    # 一部の候補が失敗した場合は残りの候補で集約する
+    if not texts:
+        raise errors[0]
+
+    candidates = []
+    with stage("json_parse"):
+        for text in texts:
+            try:
+                candidates.append(parse_json_response(text))
+            except json.JSONDecodeError:
+                candidates.append(None)
+    if not any(candidates):
+        return parse_json_response(texts[0])  # すべて不正な場合は通常と同じエラー表示にする
+    # 失敗した候補も候補数に含め、一致率が過大にならないようにする
+    candidates += [None] * len(errors)
+    with stage("vote"):
+        return aggregate(candidates)
+
+def call_gemini_api(model, input_text, prompt_cache=None, async_client=None, num_samples=1):
     try:
-        response = model.generate_content(prompt)
-        text = response.text.replace("```json", "").replace("```", "").strip()
-        return json.loads(text)
+        if num_samples > 1:
+            return sample_gemini_candidates(model, input_text, num_samples, prompt_cache, async_client)
+        if async_client:
+            runner, client = async_client
+            with stage("prompt_build"):
+                prompt = build_prompt(input_text, load_reference_text())
+            with stage("api_call"):
+                text = runner.run(client.generate(prompt))
+        elif prompt_cache:
+            with stage("api_call"):
+                text, usage = prompt_cache.generate(input_text)
+            st.session_state.last_usage = usage
+        else:
+            with stage("prompt_build"):
+                prompt = build_prompt(input_text, load_reference_text())
+            with stage("api_call"):
+                response = model.generate_content(prompt)
+                text = response.text
+        with stage("json_parse"):
+            return parse_json_response(text)
     except Exception as e:
-        error_msg = str(e)
+        error_msg = describe_error(e)
         if "429" in error_msg or "Quota exceeded" in error_msg:
             st.error("⚠️ API利用制限に達しました。")
             st.warning("Google Gemini API (無料枠) の一時的な制限です。1〜2分ほど待ってから再試行してください。")
@@ -250,6 +379,32 @@ def call_gemini_api(model, input_text):
             st.error(f"エラーが発生しました: {error_msg}")
         return None
 
+def render_usage(usage):
+    """Context Cache 利用時のトークン削減量とレイテンシを表示"""
+    if not usage: return
+    st.caption(
+        f"⚡ Context Cache: 入力 {usage.prompt_tokens} tokens 中 {usage.cached_tokens} tokens をキャッシュから供給 "
+        f"({usage.savings_ratio:.0%} 削減) / 応答 {usage.latency_ms:.0f} ms"
+    )
+
+def render_law_tags(laws):
+    """関連法規を法令インデックスで検証してタグ表示（確認できない引用は警告付き）"""
+    if isinstance(laws, str): laws = [laws]
+    tags, unknown = [], 0
+    for law in laws:
+        if law in PLACEHOLDERS:
+            tags.append(f'<span class="law-tag">{law}</span>')
+            continue
+        for citation in citation_index.check_all(law):
+            if citation.valid:
+                tags.append(f'<span class="law-tag">{citation.canonical}</span>')
+            else:
+                unknown += 1
+                tags.append(f'<span class="law-tag law-tag-unknown" title="{STATUS_LABELS[citation.status]}">⚠️ {citation.canonical}</span>')
+    st.markdown("".join(tags), unsafe_allow_html=True)
+    if unknown:
+        st.caption("⚠️ 付きの引用は法令データで確認できませんでした。条文番号を原典で確認してください。")
+
 # 結果表示
 def render_result(result):
     if not result: return
@@ -265,11 +420,13 @@ def render_result(result):
     </div>
     """
     st.markdown(html, unsafe_allow_html=True)
+    caption = consistency_caption(result)
+    if caption:
+        st.caption(caption)
 
     # 関連法規
     render_icon_header("Legal Requirements", "icon_laws.png", level="subheader")
-    laws_html = "".join([f'<span class="law-tag">{law}</span>' for law in result.get('laws', [])])
-    st.markdown(laws_html, unsafe_allow_html=True)
+    render_law_tags(result.get('laws', []))
     
     st.markdown("") 
 
@@ -310,6 +467,11 @@ with st.sidebar:
             st.session_state.current_result = None
             st.rerun()
             
+    # Self-Consistency
+    render_sidebar_label("Self-Consistency", "🗳️")
+    st.select_slider("候補数 (多数決)", options=SAMPLE_OPTIONS, key="num_samples",
+                     help="複数の候補を並行に生成し、リスクレベルを多数決で決定します（API 呼び出しは候補数分）")
+
     # Legend
     render_sidebar_label("Legend", "📊")
     st.caption("🔴 High: 重大な法的リスク")
@@ -325,19 +487,32 @@ with st.sidebar:
             if st.button(label, key=f"hist_{i}"):
                 st.session_state.current_result = item['result']
                 st.session_state.current_input = item['input']
+                st.session_state.last_usage = None
                 st.rerun()
     else:
         st.caption("履歴なし")
         
     st.markdown("---")
+    if st.session_state.history:
+        st.download_button(
+            "📦 履歴をエクスポート (Parquet)",
+            # クリックされたときだけ Parquet に変換する（再実行のたびに変換しない）
+            data=partial(history_to_parquet_bytes, list(st.session_state.history), "gemini", select_model_name()),
+            file_name=f"guardian_history_{datetime.now().strftime('%Y%m%d_%H%M')}.parquet",
+            mime="application/octet-stream",
+        )
     if st.button("🗑️ 履歴クリア"):
         st.session_state.history = []
         st.session_state.current_result = None
         st.session_state.current_input = ""
+        st.session_state.last_usage = None
         st.rerun()
 
 # --- メインエリア ---
 
+# URLに ?profile=1 を付けたリクエストは設定に関わらずプロファイリングする
+profile_requested = st.query_params.get("profile") == "1"
+
 # タイトル
 render_icon_header("New Assessment", "icon_new.png")
 
@@ -361,19 +536,32 @@ if st.button("リスク判定を実行する", type="primary"):
             st.error("APIキー設定エラー: .envファイルを確認してください")
         else:
             result = None
-            with st.spinner("Guardian AI が法令データベースと照合中..."):
-                result = call_gemini_api(model, user_input)
+            start = time.perf_counter()
+            with st.spinner("Guardian AI が法令データベースと照合中..."), profiler.request("assessment", force=profile_requested):
+                result = call_gemini_api(model, user_input, initialize_prompt_cache(), initialize_async_client(),
+                                         num_samples=st.session_state.num_samples)
+            latency_ms = (time.perf_counter() - start) * 1000
             
             if result:
                 summary = result.get('summary', user_input[:15]+"...")
-                st.session_state.history.append({
+                created_at = datetime.now()
+                item = {
                     "input": user_input,
                     "result": result,
                     "summary": summary,
-                    "timestamp": datetime.now().strftime("%H:%M")
-                })
+                    "id": uuid.uuid4().hex,
+                    "created_at": created_at,
+                    "timestamp": created_at.strftime("%H:%M"),
+                    "latency_ms": round(latency_ms, 1),
+                }
+                st.session_state.history.append(item)
+                history_store = initialize_history_store()
+                if history_store:
+                    history_store.append(history_to_record(item, "gemini", select_model_name()))
                 st.session_state.current_result = result
                 st.rerun()
 
 if st.session_state.current_result:
-    render_result(st.session_state.current_result)
\ No newline at end of file
+    with profiler.request("render", force=profile_requested), stage("render"):
+        render_result(st.session_state.current_result)
+    render_usage(st.session_state.last_usage)
\ No newline at end of file
@@ -0,0 +1,260 @@
+"""
+非同期 Gemini クライアント
+asyncio + httpx による長寿命のコネクションプールを共有し、リクエストごとのタイムアウトと
+ヘッジリクエスト（p95 を超えて応答がない場合に2本目を送信し、先に返った方を採用）に対応する
+
+使い方（ベンチマーク）:
+    python async_gemini.py --requests 200 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+from collections import deque
+
+import httpx
+
+from gemini_rest import build_request_body, extract_text, get_base_url, model_path
+
+
+class LatencyTracker:
+    """直近のレイテンシを保持し、パーセンタイルを返す"""
+
+    def __init__(self, window=200):
+        self._values = deque(maxlen=window)
+
+    def record(self, seconds):
+        self._values.append(seconds)
+
+    def __len__(self):
+        return len(self._values)
+
+    def percentile(self, q):
+        if not self._values:
+            return None
+        values = sorted(self._values)
+        return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+class AsyncGeminiClient:
+    """
+    Gemini REST API 用の非同期クライアント
+
+    Args:
+        api_key: Google API Key
+        model_name: 使用するモデル名
+        timeout: リクエストごとのタイムアウト秒数
+        max_connections: コネクションプールの上限
+        hedge: True の場合ヘッジリクエストを有効化
+        hedge_quantile: ヘッジ送信までの待ち時間に使うパーセンタイル
+        hedge_max_ratio: 全リクエストに対する追加リクエストの上限割合
+        hedge_min_samples: ヘッジを開始するのに必要なレイテンシ計測数
+    """
+
+    def __init__(self, api_key, model_name, base_url=None, generation_config=None, timeout=30.0,
+                 max_connections=20, hedge=False, hedge_quantile=95, hedge_max_ratio=0.1,
+                 hedge_min_samples=20):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.base_url = (base_url or get_base_url()).rstrip("/")
+        self.generation_config = generation_config
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_max_ratio = hedge_max_ratio
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyTracker()
+        self.request_count = 0
+        self.hedge_count = 0
+        self.hedge_wins = 0
+        # API キーはヘッダーで送る（クエリに含めると httpx の例外メッセージに URL ごと残るため）
+        self._client = httpx.AsyncClient(
+            headers={"x-goog-api-key": api_key},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def _post(self, prompt, timeout, generation_config=None):
+        response = await self._client.post(
+            f"{self.base_url}/v1beta/{model_path(self.model_name)}:generateContent",
+            json=build_request_body(prompt, generation_config or self.generation_config),
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def hedge_delay(self):
+        """ヘッジを送信するまでの待ち時間（計測数不足の場合は None）"""
+        if not self.hedge or len(self.latency) < self.hedge_min_samples:
+            return None
+        return self.latency.percentile(self.hedge_quantile)
+
+    def _hedge_budget_available(self):
+        return self.hedge_count + 1 <= self.hedge_max_ratio * self.request_count
+
+    async def generate(self, prompt, timeout=None, generation_config=None):
+        """
+        生成を実行し、レスポンスのテキストを返す
+
+        Args:
+            generation_config: このリクエストだけ生成設定を変える場合に指定（temperature など）
+
+        Raises:
+            httpx.HTTPStatusError: APIがエラーを返した場合（429 など）
+            asyncio.TimeoutError: timeout 秒以内に応答がない場合
+        """
+        timeout = timeout or self.timeout
+        self.request_count += 1
+        payload = await asyncio.wait_for(self._generate(prompt, timeout, generation_config), timeout)
+        return extract_text(payload)
+
+    async def _generate(self, prompt, timeout, generation_config=None):
+        # 記録するのはユーザーから見た待ち時間（1本目の送信から採用した応答まで）。
+        # 勝った2本目の所要時間だけを記録すると p95 が縮み続け、ヘッジが早まっていくため
+        start = time.perf_counter()
+        payload = await self._race(prompt, timeout, generation_config)
+        self.latency.record(time.perf_counter() - start)
+        return payload
+
+    async def _race(self, prompt, timeout, generation_config=None):
+        primary = asyncio.ensure_future(self._post(prompt, timeout, generation_config))
+        delay = self.hedge_delay()
+        if delay is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self._hedge_budget_available():
+            return await primary
+
+        self.hedge_count += 1
+        secondary = asyncio.ensure_future(self._post(prompt, timeout, generation_config))
+        pending = {primary, secondary}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.hedge_wins += 1
+                        return task.result()
+            # 両方失敗した場合は元のリクエストのエラーを返す
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+def describe_error(error):
+    """
+    画面表示用のエラーメッセージ（リクエスト URL やレスポンス本文を含めない）
+
+    asyncio.TimeoutError は str() が空になるため、種類ごとに固定の文言を返す
+    """
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return "Gemini API の応答がタイムアウトしました"
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"Gemini API がエラーを返しました (HTTP {error.response.status_code})"
+    if isinstance(error, httpx.RequestError):
+        return f"Gemini API に接続できませんでした ({type(error).__name__})"
+    return str(error) or type(error).__name__
+
+
+class AsyncRunner:
+    """
+    専用スレッドでイベントループを常駐させ、同期コード（Streamlit のスクリプトスレッド）から
+    コルーチンを実行するためのヘルパー。全セッションで同じコネクションプールを共有できる。
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+
+# ==========================================
+# ベンチマーク
+# ==========================================
+
+def _percentiles(latencies):
+    values = sorted(latencies)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q / 100))] * 1000
+    return pick(50), pick(99)
+
+
+async def _run_async(base_url, n, concurrency, hedge):
+    client = AsyncGeminiClient("fake", "gemini-2.5-flash", base_url=base_url, hedge=hedge,
+                               max_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await client.generate(f"ベンチマーク {i}")
+            latencies.append(time.perf_counter() - start)
+
+    # 計測用のウォームアップ（p95 の初期値を作る）
+    await asyncio.gather(*(one(i) for i in range(client.hedge_min_samples)))
+    latencies.clear()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    await client.aclose()
+    return latencies, client
+
+
+def _run_sync(base_url, n, concurrency):
+    from concurrent.futures import ThreadPoolExecutor
+    from gemini_rest import GeminiRestClient
+
+    client = GeminiRestClient("fake", base_url=base_url)
+
+    def one(i):
+        start = time.perf_counter()
+        client.generate("gemini-2.5-flash", f"ベンチマーク {i}")
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(n)))
+
+
+def main(argv=None):
+    from fake_gemini_server import FakeModelProfile, start_fake_server
+
+    parser = argparse.ArgumentParser(description="同期 / 非同期 / ヘッジ の p50・p99 比較")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ttft-ms", type=float, default=80)
+    parser.add_argument("--jitter-ms", type=float, default=40)
+    parser.add_argument("--tail-prob", type=float, default=0.03)
+    parser.add_argument("--tail-ms", type=float, default=1500)
+    args = parser.parse_args(argv)
+
+    profile = FakeModelProfile(ttft_ms=args.ttft_ms, tokens_per_sec=5000, jitter_ms=args.jitter_ms,
+                               tail_prob=args.tail_prob, tail_ms=args.tail_ms)
+    print(f"{'mode':<14} {'p50(ms)':>8} {'p99(ms)':>8} {'upstream/req':>13}")
+    for mode in ("sync", "async", "async+hedge"):
+        server = start_fake_server({"gemini-2.5-flash": profile}, seed=0)
+        try:
+            if mode == "sync":
+                latencies = _run_sync(server.base_url, args.requests, args.concurrency)
+                sent = args.requests
+            else:
+                before = server.request_count
+                latencies, client = asyncio.run(
+                    _run_async(server.base_url, args.requests, args.concurrency, mode == "async+hedge"))
+                sent = server.request_count - before - client.hedge_min_samples
+            p50, p99 = _percentiles(latencies)
+            print(f"{mode:<14} {p50:>8.0f} {p99:>8.0f} {sent / args.requests:>13.2f}")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,331 @@
 """
-利用可能なGemini APIモデルを確認するスクリプト
+利用可能なGemini APIモデルを確認し、速度ベンチマークで推奨モデルを選定するスクリプト
+
+generateContent 対応モデルごとに Guardian AI の固定プロンプトを送信し、
+TTFT・総レイテンシ・出力トークン/秒・JSON妥当率を計測してランキングを出力する。
+出力した model_ranking.json は app_gemini.py の initialize_gemini が読み込む。
+
+使い方:
+    python check_models.py                  # モデル一覧取得 + ベンチマーク
+    python check_models.py --list-only      # モデル一覧のみ表示
+    python check_models.py --fake           # ローカルのフェイクサーバーでオフライン実行（model_ranking.fake.json に出力）
 """
 
-import google.generativeai as genai
+import argparse
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 from dotenv import load_dotenv
 
-# .envファイルから環境変数を読み込む
-load_dotenv()
-
-# APIキーを設定
-api_key = os.environ.get("GOOGLE_API_KEY")
-
-if not api_key:
-    print("❌ エラー: GOOGLE_API_KEY が設定されていません")
-    print("\n.env ファイルに以下の形式で設定してください:")
-    print("GOOGLE_API_KEY=your_actual_api_key_here")
-    exit(1)
-
-print(f"✅ APIキー確認: {api_key[:4]}...{api_key[-4:]}")
-print("\n" + "="*60)
-print("利用可能なGemini モデル一覧")
-print("="*60 + "\n")
-
-try:
-    genai.configure(api_key=api_key)
-    
-    # 利用可能なモデルをリスト
-    models = genai.list_models()
-    
-    gemini_models = []
+from gemini_rest import GeminiRestClient, extract_text, get_base_url
+from prompts import build_prompt, parse_json_response
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(CURRENT_DIR, '..', '.cache')
+DEFAULT_RANKING_PATH = os.path.join(CURRENT_DIR, '..', 'model_ranking.json')
+# フェイクサーバーでの計測結果は本番のランキングを上書きしないよう別ファイルに出力
+FAKE_RANKING_PATH = os.path.join(CURRENT_DIR, '..', 'model_ranking.fake.json')
+
+# ベンチマーク用の固定プロンプト（Quick Demo と同じ事例）
+BENCH_SPECS = [
+    "アプリ内でユーザーが購入したポイントを、手数料を引いて現金化し、銀行口座に振り込む機能を実装します。資金決済法の登録は行いません。",
+    "社内タスク管理ツールです。社員の氏名のみ保存し、アクセス権限を管理職に限定。退職者のデータは30日で物理削除します。",
+    "ユーザーの顔写真を収集し、マーケティングに使用するアプリを開発します。",
+]
+GENERATION_CONFIG = {"temperature": 0.3, "maxOutputTokens": 4000}
+
+
+# ==========================================
+# モデル一覧（ディスクキャッシュ付き）
+# ==========================================
+
+def fetch_catalog(client, cache_dir=CACHE_DIR, ttl_seconds=86400, refresh=False):
+    """
+    generateContent をサポートするモデル一覧を取得
+
+    Returns:
+        list[dict]: name / displayName / description / supportedGenerationMethods
+    """
+    key = hashlib.sha1(client.base_url.encode("utf-8")).hexdigest()[:10]
+    path = os.path.join(cache_dir, f"models_catalog_{key}.json")
+    if not refresh and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if time.time() - cached["fetched_at"] < ttl_seconds:
+            return cached["models"]
+
+    models = [
+        m for m in client.list_models()
+        if "generateContent" in m.get("supportedGenerationMethods", [])
+    ]
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"fetched_at": time.time(), "models": models}, f, ensure_ascii=False, indent=2)
+    return models
+
+
+# ==========================================
+# ベンチマーク
+# ==========================================
+
+def percentile(values, q):
+    """線形補間によるパーセンタイル（q: 0〜100）"""
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+def benchmark_once(client, model_name, prompt):
+    """ストリーミングで1回生成し、TTFT・総レイテンシ・出力トークン数・JSON妥当性を計測"""
+    start = time.perf_counter()
+    ttft = None
+    texts, usage = [], {}
+    try:
+        for chunk in client.stream_generate(model_name, prompt, GENERATION_CONFIG):
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            texts.append(extract_text(chunk))
+            usage = chunk.get("usageMetadata", usage)
+    except Exception as e:
+        return {"error": str(e)}
+    latency = time.perf_counter() - start
+
+    try:
+        json_valid = "risk_level" in parse_json_response("".join(texts))
+    except (ValueError, TypeError):
+        json_valid = False
+
+    output_tokens = usage.get("candidatesTokenCount", 0)
+    gen_seconds = latency - (ttft or 0)
+    return {
+        "ttft_ms": (ttft or latency) * 1000,
+        "latency_ms": latency * 1000,
+        "output_tokens": output_tokens,
+        "tokens_per_sec": output_tokens / gen_seconds if gen_seconds > 0 else 0.0,
+        "json_valid": json_valid,
+    }
+
+
+def summarize(model_name, samples):
+    """計測結果を集計"""
+    ok = [s for s in samples if "error" not in s]
+
+    def p(key, q):
+        value = percentile([s[key] for s in ok], q)
+        return round(value, 1) if value is not None else None
+
+    return {
+        "model": model_name,
+        "requests": len(samples),
+        "error_rate": round(1 - len(ok) / len(samples), 3) if samples else 1.0,
+        "json_valid_rate": round(sum(s["json_valid"] for s in ok) / len(samples), 3) if samples else 0.0,
+        "ttft_ms_p50": p("ttft_ms", 50),
+        "latency_ms_p50": p("latency_ms", 50),
+        "latency_ms_p95": p("latency_ms", 95),
+        "tokens_per_sec_p50": p("tokens_per_sec", 50),
+    }
+
+
+def benchmark_model(client, model_name, runs=1, concurrency=1, cache_dir=CACHE_DIR,
+                    ttl_seconds=86400, refresh=False):
+    """
+    1モデル分のベンチマークを実行（同条件の結果がキャッシュにあれば再利用）
+
+    Args:
+        runs: 各プロンプトの実行回数
+        concurrency: 同時リクエスト数
+    """
+    prompts = [build_prompt(spec) for spec in BENCH_SPECS]
+    key_src = json.dumps([client.base_url, model_name, prompts, runs, concurrency, GENERATION_CONFIG])
+    key = hashlib.sha1(key_src.encode("utf-8")).hexdigest()[:10]
+    path = os.path.join(cache_dir, f"bench_{model_name.replace('/', '_')}_{key}.json")
+    if not refresh and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if time.time() - cached["measured_at"] < ttl_seconds:
+            return cached["summary"]
+
+    tasks = prompts * runs
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        samples = list(pool.map(lambda prompt: benchmark_once(client, model_name, prompt), tasks))
+    summary = summarize(model_name, samples)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"measured_at": time.time(), "summary": summary, "samples": samples},
+                  f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def rank(summaries, min_json_valid_rate=0.9):
+    """
+    JSON妥当率が基準を満たし、エラーのないモデルを優先し、p50レイテンシの昇順に並べる
+    """
+    def key(s):
+        eligible = s["error_rate"] == 0 and s["json_valid_rate"] >= min_json_valid_rate
+        return (not eligible, s["latency_ms_p50"] if s["latency_ms_p50"] is not None else float("inf"))
+
+    ranked = sorted(summaries, key=key)
+    for i, s in enumerate(ranked, 1):
+        s["rank"] = i
+        s["eligible"] = not key(s)[0]
+    return ranked
+
+
+def write_ranking(path, ranked, base_url, min_json_valid_rate):
+    """initialize_gemini が読み込むランキング設定を書き出す"""
+    eligible = [s for s in ranked if s["eligible"]]
+    config = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "base_url": base_url,
+        "criteria": {"min_json_valid_rate": min_json_valid_rate, "order_by": "latency_ms_p50"},
+        "recommended": eligible[0]["model"].replace("models/", "") if eligible else None,
+        "models": ranked,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    return config
+
+
+def load_ranked_model(path=None, base_url=None):
+    """
+    ランキング設定から推奨モデル名を取得
+
+    Args:
+        path: 設定ファイルのパス。未指定時は MODEL_RANKING_PATH または既定パス
+        base_url: 接続先のベースURL。異なる接続先（フェイクサーバーなど）で計測した設定は無視する
+
+    Returns:
+        str | None: 推奨モデル名（設定がない・接続先が異なる場合は None）
+    """
+    path = path or os.environ.get("MODEL_RANKING_PATH", DEFAULT_RANKING_PATH)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return None
+    base_url = (base_url or get_base_url()).rstrip("/")
+    if config.get("base_url", "").rstrip("/") != base_url:
+        print(f"⚠️ {path} は別の接続先 ({config.get('base_url')}) で計測されたため使用しません")
+        return None
+    return config.get("recommended")
+
+
+# ==========================================
+# CLI
+# ==========================================
+
+def print_catalog(models):
     for model in models:
-        # generateContent をサポートしているモデルのみ表示
-        if 'generateContent' in model.supported_generation_methods:
-            gemini_models.append(model)
-            print(f"📝 モデル名: {model.name}")
-            print(f"   表示名: {model.display_name}")
-            print(f"   説明: {model.description}")
-            print(f"   サポートメソッド: {', '.join(model.supported_generation_methods)}")
-            print()
-    
-    if not gemini_models:
-        print("⚠️ generateContent をサポートするモデルが見つかりませんでした")
+        print(f"📝 モデル名: {model['name']}")
+        print(f"   表示名: {model.get('displayName', '')}")
+        print(f"   説明: {model.get('description', '')}")
+        print(f"   サポートメソッド: {', '.join(model.get('supportedGenerationMethods', []))}")
+        print()
+
+
+def print_ranking(ranked):
+    print(f"{'#':>2}  {'モデル':<36} {'TTFT p50':>9} {'p50':>8} {'p95':>8} {'tok/s':>7} {'JSON':>6} {'err':>5}")
+    for s in ranked:
+        mark = "✅" if s["eligible"] else "⚠️"
+        fmt = lambda v, spec: format(v, spec) if v is not None else "-"
+        print(f"{s['rank']:>2}{mark} {s['model'].replace('models/', ''):<36} "
+              f"{fmt(s['ttft_ms_p50'], '>9.0f')} {fmt(s['latency_ms_p50'], '>8.0f')} "
+              f"{fmt(s['latency_ms_p95'], '>8.0f')} {fmt(s['tokens_per_sec_p50'], '>7.1f')} "
+              f"{s['json_valid_rate']:>6.0%} {s['error_rate']:>5.0%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gemini モデル一覧の確認と速度ベンチマーク")
+    parser.add_argument("--list-only", action="store_true", help="モデル一覧のみ表示する")
+    parser.add_argument("--models", nargs="*", help="ベンチマーク対象のモデル名（未指定時は全モデル）")
+    parser.add_argument("--runs", type=int, default=1, help="各プロンプトの実行回数")
+    parser.add_argument("--concurrency", type=int, default=2, help="同時リクエスト数")
+    parser.add_argument("--min-json-valid-rate", type=float, default=0.9)
+    parser.add_argument("--output", help="ランキング設定の出力先（既定: model_ranking.json、--fake 時は model_ranking.fake.json）")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--cache-ttl", type=int, default=86400, help="一覧・結果キャッシュの有効秒数")
+    parser.add_argument("--refresh", action="store_true", help="キャッシュを使わず再取得する")
+    parser.add_argument("--fake", action="store_true", help="ローカルのフェイクサーバーに接続する")
+    args = parser.parse_args(argv)
+    args.output = args.output or (FAKE_RANKING_PATH if args.fake else DEFAULT_RANKING_PATH)
+
+    # .envファイルから環境変数を読み込む
+    load_dotenv()
+
+    server = None
+    if args.fake:
+        from fake_gemini_server import start_fake_server
+        server = start_fake_server()
+        api_key, base_url = "fake", server.base_url
+        print(f"🧪 フェイクサーバーを使用: {base_url}")
     else:
+        api_key, base_url = os.environ.get("GOOGLE_API_KEY"), None
+        if not api_key:
+            print("❌ エラー: GOOGLE_API_KEY が設定されていません")
+            print("\n.env ファイルに以下の形式で設定してください:")
+            print("GOOGLE_API_KEY=your_actual_api_key_here")
+            return 1
+        print(f"✅ APIキー確認: {api_key[:4]}...{api_key[-4:]}")
+
+    client = GeminiRestClient(api_key, base_url=base_url)
+    try:
+        models = fetch_catalog(client, args.cache_dir, args.cache_ttl, args.refresh)
+        print("\n" + "="*60)
+        print("利用可能なGemini モデル一覧")
+        print("="*60 + "\n")
+        if not models:
+            print("⚠️ generateContent をサポートするモデルが見つかりませんでした")
+            return 1
+        if args.list_only:
+            print_catalog(models)
+            print(f"✅ 合計 {len(models)} 個のモデルが利用可能です")
+            return 0
+
+        names = [m["name"] for m in models]
+        if args.models:
+            names = [n for n in names if n.replace("models/", "") in args.models or n in args.models]
+        print(f"✅ 合計 {len(models)} 個のモデルが利用可能です（ベンチマーク対象: {len(names)} 個）\n")
+
+        summaries = []
+        for name in names:
+            print(f"⏱️ 計測中: {name}")
+            summaries.append(benchmark_model(
+                client, name, runs=args.runs, concurrency=args.concurrency,
+                cache_dir=args.cache_dir, ttl_seconds=args.cache_ttl, refresh=args.refresh,
+            ))
+
+        ranked = rank(summaries, args.min_json_valid_rate)
+        print("\n" + "="*60)
+        print_ranking(ranked)
+        config = write_ranking(args.output, ranked, client.base_url, args.min_json_valid_rate)
         print("="*60)
-        print(f"\n✅ 合計 {len(gemini_models)} 個のモデルが利用可能です\n")
-        print("【推奨モデル名（app_gemini.py で使用）】")
-        for model in gemini_models[:3]:  # 最初の3つを表示
-            # "models/" プレフィックスを除去
-            model_name = model.name.replace("models/", "")
-            print(f"  • {model_name}")
-
-except Exception as e:
-    print(f"❌ エラーが発生しました: {e}")
-    print("\n【考えられる原因】")
-    print("1. APIキーが無効または期限切れ")
-    print("2. インターネット接続の問題")
-    print("3. Google AI Studio でAPIが有効化されていない")
+        print(f"\n【推奨モデル名（app_gemini.py で使用）】 {config['recommended']}")
+        print(f"📄 ランキング設定を出力しました: {os.path.abspath(args.output)}")
+        return 0
+
+    except Exception as e:
+        print(f"❌ エラーが発生しました: {e}")
+        print("\n【考えられる原因】")
+        print("1. APIキーが無効または期限切れ")
+        print("2. インターネット接続の問題")
+        print("3. Google AI Studio でAPIが有効化されていない")
+        return 1
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,202 @@
+"""
+ローカル用フェイク Gemini サーバー
+generativelanguage v1beta の REST API（モデル一覧・generateContent・streamGenerateContent）を模倣し、
+モデルごとの応答速度やレイテンシのばらつきを再現する。オフラインでのベンチマーク・検証用。
+
+使い方:
+    python fake_gemini_server.py --port 8765
+    GEMINI_API_BASE=http://127.0.0.1:8765 python check_models.py
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_RESPONSE = {
+    "risk_level": "High",
+    "summary": "無登録での資金移動",
+    "laws": ["資金決済法", "銀行法"],
+    "reason": "ユーザー間またはユーザーへの資金移動を業として行う場合、資金移動業の登録が必要です。",
+    "recommendations": ["資金移動業の登録を検討する", "ポイントの換金性を排除する", "専門家に相談する"],
+}
+
+
+@dataclass
+class FakeModelProfile:
+    """フェイクモデルの応答特性"""
+    ttft_ms: float = 200.0           # 最初のチャンクまでの時間
+    tokens_per_sec: float = 200.0    # 出力トークンの生成速度
+    json_valid_rate: float = 1.0     # 正しいJSONを返す確率
+    jitter_ms: float = 0.0           # 一様分布の揺らぎ
+    tail_prob: float = 0.0           # テールレイテンシが発生する確率
+    tail_ms: float = 0.0             # テール発生時に追加される遅延
+
+
+DEFAULT_PROFILES = {
+    "gemini-2.5-flash": FakeModelProfile(ttft_ms=250, tokens_per_sec=220),
+    "gemini-2.5-flash-lite": FakeModelProfile(ttft_ms=120, tokens_per_sec=300, json_valid_rate=0.9),
+    "gemini-2.5-pro": FakeModelProfile(ttft_ms=600, tokens_per_sec=90),
+}
+
+_PATH_RE = re.compile(r"^/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)$")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path != "/v1beta/models":
+            self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+            return
+        models = [{
+            "name": f"models/{name}",
+            "displayName": name,
+            "description": "Fake model served by fake_gemini_server.py",
+            "supportedGenerationMethods": ["generateContent", "countTokens"],
+        } for name in self.server.profiles]
+        models.append({
+            "name": "models/text-embedding-004",
+            "displayName": "Text Embedding",
+            "description": "Embedding only",
+            "supportedGenerationMethods": ["embedContent"],
+        })
+        self._send_json(200, {"models": models})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        match = _PATH_RE.match(path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        profile = self.server.profiles.get(match.group(1)) if match else None
+        if profile is None:
+            self._send_json(404, {"error": {"code": 404, "message": f"Model not found: {path}"}})
+            return
+
+        self.server.record_request()
+        prompt = "".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+        text = self.server.response_text(profile)
+        output_tokens = max(1, len(text) // 2)
+        usage = {
+            "promptTokenCount": max(1, len(prompt) // 2),
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": max(1, len(prompt) // 2) + output_tokens,
+        }
+
+        time.sleep(self.server.first_token_delay(profile) / 1000)
+        gen_seconds = output_tokens / profile.tokens_per_sec
+
+        if match.group(2) == "generateContent":
+            time.sleep(gen_seconds)
+            self._send_json(200, _chunk(text, usage))
+            return
+
+        # Server-Sent Events でチャンクを送信
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        pieces = [text[i:i + 40] for i in range(0, len(text), 40)] or [""]
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(gen_seconds / len(pieces))
+            payload = _chunk(piece, usage if i == len(pieces) - 1 else None)
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+            self.wfile.flush()
+        self.close_connection = True
+
+
+def _chunk(text, usage=None):
+    payload = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}]}
+    if usage:
+        payload["usageMetadata"] = usage
+    return payload
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    """プロファイルに従って応答するフェイクサーバー"""
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), profiles=None, seed=None):
+        super().__init__(address, _Handler)
+        self.profiles = dict(profiles or DEFAULT_PROFILES)
+        self.request_count = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # ヘッジで不要になったリクエストはクライアント側から切断されるため無視する
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def first_token_delay(self, profile):
+        with self._lock:
+            delay = profile.ttft_ms + self._rng.uniform(0, profile.jitter_ms)
+            if self._rng.random() < profile.tail_prob:
+                delay += profile.tail_ms
+        return delay
+
+    def response_text(self, profile):
+        with self._lock:
+            valid = self._rng.random() < profile.json_valid_rate
+        text = "```json\n" + json.dumps(SAMPLE_RESPONSE, ensure_ascii=False, indent=2) + "\n```"
+        # JSON崩れを再現するため末尾を切り落とす
+        return text if valid else text[: len(text) // 2]
+
+
+def start_fake_server(profiles=None, port=0, seed=None):
+    """
+    バックグラウンドスレッドでフェイクサーバーを起動
+
+    Returns:
+        FakeGeminiServer: 停止時は shutdown() と server_close() を呼ぶ
+    """
+    server = FakeGeminiServer(("127.0.0.1", port), profiles=profiles, seed=seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ローカル用フェイク Gemini サーバー")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tail-prob", type=float, default=0.0, help="テールレイテンシの発生確率")
+    parser.add_argument("--tail-ms", type=float, default=0.0, help="テール発生時の追加遅延 (ms)")
+    args = parser.parse_args()
+
+    profiles = {
+        name: FakeModelProfile(**{**vars(p), "tail_prob": args.tail_prob, "tail_ms": args.tail_ms})
+        for name, p in DEFAULT_PROFILES.items()
+    }
+    server = FakeGeminiServer(("127.0.0.1", args.port), profiles=profiles)
+    print(f"🧪 Fake Gemini server: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
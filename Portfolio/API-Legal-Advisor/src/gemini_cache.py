@@ -0,0 +1,298 @@
+"""
+Gemini Context Caching モジュール
+固定の指示文と法令プリアンブルをプロバイダ側に一度だけアップロードし、
+各リクエストではユーザー仕様のみを送信する
+"""
+
+import datetime
+import threading
+import time
+from dataclasses import dataclass
+
+from prompts import GUARDIAN_INSTRUCTION, build_prompt, build_user_prompt
+
+
+@dataclass
+class CacheUsage:
+    """1リクエスト分のトークン使用量とレイテンシ"""
+    prompt_tokens: int
+    cached_tokens: int
+    output_tokens: int
+    latency_ms: float
+
+    @property
+    def uncached_tokens(self):
+        """キャッシュから供給されず、新規に処理された入力トークン数"""
+        return self.prompt_tokens - self.cached_tokens
+
+    @property
+    def savings_ratio(self):
+        """入力トークンのうちキャッシュで賄われた割合"""
+        if not self.prompt_tokens:
+            return 0.0
+        return self.cached_tokens / self.prompt_tokens
+
+
+def _usage_from_response(response, latency_ms):
+    meta = response.usage_metadata
+    return CacheUsage(
+        prompt_tokens=meta.prompt_token_count,
+        cached_tokens=getattr(meta, "cached_content_token_count", 0) or 0,
+        output_tokens=meta.candidates_token_count,
+        latency_ms=latency_ms,
+    )
+
+
+# ==========================================
+# バックエンド
+# ==========================================
+
+class GeminiCacheBackend:
+    """google.generativeai の CachedContent を利用する本番用バックエンド"""
+
+    def __init__(self, model_name, generation_config=None):
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        self._genai = genai
+        self._caching = caching
+        # CachedContent はバージョン付きのモデル名でのみ作成可能
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        self.generation_config = generation_config
+
+    def create(self, system_instruction, contents, ttl_seconds):
+        return self._caching.CachedContent.create(
+            model=self.model_name,
+            display_name="guardian-ai-preamble",
+            system_instruction=system_instruction,
+            contents=contents or None,
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+        )
+
+    def refresh(self, handle, ttl_seconds):
+        handle.update(ttl=datetime.timedelta(seconds=ttl_seconds))
+
+    def delete(self, handle):
+        handle.delete()
+
+    def expire_time(self, handle):
+        return handle.expire_time.timestamp()
+
+    def generate(self, handle, user_text, generation_config=None):
+        model = self._genai.GenerativeModel.from_cached_content(
+            cached_content=handle, generation_config=generation_config or self.generation_config
+        )
+        start = time.perf_counter()
+        response = model.generate_content(user_text)
+        return response.text, _usage_from_response(response, (time.perf_counter() - start) * 1000)
+
+    def generate_uncached(self, full_prompt, generation_config=None):
+        model = self._genai.GenerativeModel(self.model_name,
+                                            generation_config=generation_config or self.generation_config)
+        start = time.perf_counter()
+        response = model.generate_content(full_prompt)
+        return response.text, _usage_from_response(response, (time.perf_counter() - start) * 1000)
+
+
+class LocalCacheBackend:
+    """
+    ネットワークを使わない代替バックエンド（テスト・オフライン検証用）
+    GeminiCacheBackend と同じインターフェースを持ち、未キャッシュの入力トークン数に
+    比例した処理時間を擬似的に再現する
+    """
+
+    def __init__(self, response_text=None, base_latency_ms=50.0, per_token_ms=0.05,
+                 clock=time.time, sleep=time.sleep):
+        self.response_text = response_text or (
+            '{"risk_level": "Medium", "summary": "ローカル応答", "laws": [], '
+            '"reason": "LocalCacheBackend による応答です。", "recommendations": []}'
+        )
+        self.base_latency_ms = base_latency_ms
+        self.per_token_ms = per_token_ms
+        self._clock = clock
+        self._sleep = sleep
+        self._caches = {}
+        self._next_id = 0
+        self.create_count = 0
+        self.refresh_count = 0
+
+    @staticmethod
+    def count_tokens(text):
+        """簡易トークン数推定（日本語はおおよそ1〜2文字で1トークン）"""
+        return max(1, len(text) // 2) if text else 0
+
+    def create(self, system_instruction, contents, ttl_seconds):
+        self._next_id += 1
+        self.create_count += 1
+        handle = f"cachedContents/local-{self._next_id}"
+        preamble = "\n\n".join([system_instruction] + list(contents or []))
+        self._caches[handle] = {
+            "tokens": self.count_tokens(preamble),
+            "expire_time": self._clock() + ttl_seconds,
+        }
+        return handle
+
+    def refresh(self, handle, ttl_seconds):
+        if handle not in self._caches:
+            raise KeyError(f"{handle} は存在しません")
+        self.refresh_count += 1
+        self._caches[handle]["expire_time"] = self._clock() + ttl_seconds
+
+    def delete(self, handle):
+        self._caches.pop(handle, None)
+
+    def expire_time(self, handle):
+        return self._caches[handle]["expire_time"]
+
+    def _respond(self, prompt_tokens, cached_tokens):
+        uncached = prompt_tokens - cached_tokens
+        latency_ms = self.base_latency_ms + uncached * self.per_token_ms
+        self._sleep(latency_ms / 1000)
+        usage = CacheUsage(
+            prompt_tokens=prompt_tokens,
+            cached_tokens=cached_tokens,
+            output_tokens=self.count_tokens(self.response_text),
+            latency_ms=latency_ms,
+        )
+        return self.response_text, usage
+
+    def generate(self, handle, user_text, generation_config=None):
+        cache = self._caches.get(handle)
+        if cache is None or cache["expire_time"] <= self._clock():
+            raise KeyError(f"{handle} は期限切れです")
+        cached = cache["tokens"]
+        return self._respond(cached + self.count_tokens(user_text), cached)
+
+    def generate_uncached(self, full_prompt, generation_config=None):
+        return self._respond(self.count_tokens(full_prompt), 0)
+
+
+# ==========================================
+# キャッシュ管理
+# ==========================================
+
+class PromptCache:
+    """
+    固定プリアンブルのキャッシュを管理するクラス
+
+    キャッシュは初回リクエスト時に作成され、期限の refresh_margin_seconds 前を過ぎると
+    TTL を延長する。作成に失敗した場合（最小トークン数未満・一時的な通信エラーなど）は
+    キャッシュなしで送信し、retry_seconds 後に作成を再試行する（失敗が続くたびに間隔を倍にし、
+    max_retry_seconds で頭打ち）。
+    """
+
+    def __init__(self, backend, system_instruction=GUARDIAN_INSTRUCTION, reference_text="",
+                 ttl_seconds=3600, refresh_margin_seconds=300, clock=time.time,
+                 retry_seconds=60, max_retry_seconds=3600):
+        self.backend = backend
+        self.system_instruction = system_instruction
+        self.reference_text = reference_text
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._handle = None
+        self._expire_time = 0.0
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._failures = 0
+        self._retry_at = 0.0  # 作成に失敗した場合、この時刻まではキャッシュなしで送信
+
+    def _contents(self):
+        return [f"【参考法令】\n{self.reference_text}"] if self.reference_text else []
+
+    def _ensure_handle(self):
+        """有効なキャッシュハンドルを返す（必要に応じて作成・延長。再試行待ちの間は None）"""
+        with self._lock:
+            now = self._clock()
+            if self._handle is not None and now < self._expire_time - self.refresh_margin_seconds:
+                return self._handle
+            if self._handle is None and now < self._retry_at:
+                return None
+
+            if self._handle is not None:
+                try:
+                    self.backend.refresh(self._handle, self.ttl_seconds)
+                    self._expire_time = self.backend.expire_time(self._handle)
+                    return self._handle
+                except Exception:
+                    # 期限切れ・削除済みの場合は作り直す
+                    self._handle = None
+
+            try:
+                self._handle = self.backend.create(self.system_instruction, self._contents(), self.ttl_seconds)
+                self._expire_time = self.backend.expire_time(self._handle)
+                self._failures = 0
+            except Exception as e:
+                wait = min(self.retry_seconds * 2 ** self._failures, self.max_retry_seconds)
+                self._failures += 1
+                self._retry_at = now + wait
+                self._handle = None
+                print(f"Context Cache の作成に失敗したため、{wait:.0f} 秒間キャッシュなしで送信します: {e}")
+            return self._handle
+
+    def generate(self, input_text, generation_config=None):
+        """
+        ユーザー仕様のみを送信して診断を実行
+
+        Args:
+            generation_config: このリクエストだけ生成設定を変える場合に指定（temperature など）
+
+        Returns:
+            tuple: (response_text, CacheUsage)
+        """
+        handle = self._ensure_handle()
+        if handle is None:
+            text, usage = self.backend.generate_uncached(build_prompt(input_text, self.reference_text),
+                                                         generation_config)
+        else:
+            text, usage = self.backend.generate(handle, build_user_prompt(input_text), generation_config)
+        return text, usage
+
+    def close(self):
+        """キャッシュを明示的に削除（TTL切れを待たずに課金を止める）"""
+        with self._lock:
+            if self._handle is not None:
+                try:
+                    self.backend.delete(self._handle)
+                finally:
+                    self._handle = None
+
+
+def compare(backend, input_texts, reference_text="", **kwargs):
+    """
+    キャッシュあり・なしで同じ入力を送信し、リクエストごとの差分を返す
+
+    Returns:
+        list[dict]: 各リクエストの入力トークン削減数とレイテンシ変化
+    """
+    cache = PromptCache(backend, reference_text=reference_text, **kwargs)
+    rows = []
+    for text in input_texts:
+        _, base = backend.generate_uncached(build_prompt(text, reference_text))
+        _, cached = cache.generate(text)
+        rows.append({
+            "input_tokens_uncached": base.prompt_tokens,
+            "input_tokens_billed": cached.uncached_tokens,
+            "tokens_saved": base.prompt_tokens - cached.uncached_tokens,
+            "latency_ms_uncached": base.latency_ms,
+            "latency_ms_cached": cached.latency_ms,
+            "latency_change_ms": cached.latency_ms - base.latency_ms,
+        })
+    cache.close()
+    return rows
+
+
+if __name__ == "__main__":
+    # オフライン検証: LocalCacheBackend で削減効果を表示
+    samples = [
+        "アプリ内ポイントを現金化して銀行口座に振り込む機能を実装します。",
+        "社内タスク管理ツールです。社員の氏名のみ保存します。",
+        "ユーザーの顔写真を収集し、マーケティングに使用するアプリ",
+    ]
+    reference = "個人情報の保護に関する法律 第27条（第三者提供の制限）...\n" * 200
+    print(f"{'#':>2} {'uncached':>9} {'billed':>7} {'saved':>7} {'lat(ms)':>9} {'cached(ms)':>11} {'delta':>8}")
+    for i, row in enumerate(compare(LocalCacheBackend(sleep=lambda s: None), samples, reference), 1):
+        print(f"{i:>2} {row['input_tokens_uncached']:>9} {row['input_tokens_billed']:>7} "
+              f"{row['tokens_saved']:>7} {row['latency_ms_uncached']:>9.1f} "
+              f"{row['latency_ms_cached']:>11.1f} {row['latency_change_ms']:>+8.1f}")
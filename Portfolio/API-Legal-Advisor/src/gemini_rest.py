@@ -0,0 +1,100 @@
+"""
+Gemini REST API 簡易クライアント
+ベンチマーク用に標準ライブラリのみで実装（接続先を差し替えてローカルのフェイクサーバーにも接続可能）
+"""
+
+import json
+import os
+import urllib.parse
+import urllib.request
+
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com"
+
+
+def get_base_url():
+    """接続先のベースURL（GEMINI_API_BASE で上書き可能）"""
+    return os.environ.get("GEMINI_API_BASE", DEFAULT_BASE_URL).rstrip("/")
+
+
+def model_path(model_name):
+    """'gemini-2.5-flash' / 'models/gemini-2.5-flash' のどちらでも受け付ける"""
+    return model_name if "/" in model_name else f"models/{model_name}"
+
+
+def extract_text(payload):
+    """generateContent のレスポンスからテキスト部分を連結して取り出す"""
+    texts = []
+    for candidate in payload.get("candidates", []):
+        for part in candidate.get("content", {}).get("parts", []):
+            texts.append(part.get("text", ""))
+    return "".join(texts)
+
+
+def build_request_body(prompt, generation_config=None):
+    body = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+    if generation_config:
+        body["generationConfig"] = generation_config
+    return body
+
+
+class GeminiRestClient:
+    """generativelanguage v1beta REST API のうち、モデル一覧と生成のみを扱うクライアント"""
+
+    def __init__(self, api_key, base_url=None, timeout=60):
+        self.api_key = api_key
+        self.base_url = (base_url or get_base_url()).rstrip("/")
+        self.timeout = timeout
+
+    def _url(self, path, **params):
+        query = f"?{urllib.parse.urlencode(params)}" if params else ""
+        return f"{self.base_url}/v1beta/{path}{query}"
+
+    def _headers(self):
+        # API キーはヘッダーで送る（クエリに含めると例外メッセージやログに URL ごと残るため）
+        return {"Content-Type": "application/json", "x-goog-api-key": self.api_key}
+
+    def _get(self, path, **params):
+        req = urllib.request.Request(self._url(path, **params), headers=self._headers())
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    def list_models(self):
+        """全モデルのメタデータを返す（ページングを辿る）"""
+        models, page_token = [], None
+        while True:
+            params = {"pageSize": 1000}
+            if page_token:
+                params["pageToken"] = page_token
+            data = self._get("models", **params)
+            models.extend(data.get("models", []))
+            page_token = data.get("nextPageToken")
+            if not page_token:
+                return models
+
+    def generate(self, model_name, prompt, generation_config=None):
+        """非ストリーミング生成。レスポンスJSONをそのまま返す"""
+        req = urllib.request.Request(
+            self._url(f"{model_path(model_name)}:generateContent"),
+            data=json.dumps(build_request_body(prompt, generation_config)).encode("utf-8"),
+            headers=self._headers(),
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    def stream_generate(self, model_name, prompt, generation_config=None):
+        """
+        ストリーミング生成（Server-Sent Events）
+
+        Yields:
+            dict: 受信したチャンクごとのレスポンスJSON
+        """
+        req = urllib.request.Request(
+            self._url(f"{model_path(model_name)}:streamGenerateContent", alt="sse"),
+            data=json.dumps(build_request_body(prompt, generation_config)).encode("utf-8"),
+            headers=self._headers(),
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            for raw in resp:
+                line = raw.decode("utf-8").strip()
+                if line.startswith("data:"):
+                    yield json.loads(line[len("data:"):].strip())
@@ -0,0 +1,431 @@
+"""
+同時接続負荷テストツール
+`streamlit run` で app_gemini.py / app_local.py を起動し、Streamlit の WebSocket プロトコル
+（/_stcore/stream）で N 人の仮想ユーザーを接続する。各ユーザーは Quick Demo のクリック →
+診断実行 → 履歴閲覧 を繰り返す。推論バックエンドは遅延を設定できるフェイクに差し替える。
+
+計測項目:
+    - スループット（シナリオ/秒）
+    - ステップごとのレイテンシ（p50 / p95 / p99）
+    - サーバープロセスのメモリ増加量（RSS）
+    - 飽和が始まる同時ユーザー数
+
+使い方:
+    python load_test.py --users 16 --latency-ms 800
+    python load_test.py --app ../../FT-Legal-Advisor/src/app_local.py --users 8
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import types
+import urllib.request
+from contextlib import ExitStack
+from unittest import mock
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_APP = os.path.join(CURRENT_DIR, "app_gemini.py")
+
+FAKE_RESULT = {
+    "risk_level": "High",
+    "summary": "負荷試験",
+    "laws": ["資金決済法"],
+    "reason": "フェイクバックエンドによる応答です。",
+    "recommendations": ["専門家に相談する"],
+}
+SUBMIT_LABEL = "リスク判定を実行する"
+
+
+class AppNotReady(RuntimeError):
+    """初回のスクリプト実行でボタンが1つも描画されなかった（st.stop() やモデル読み込み失敗など）"""
+
+
+# ==========================================
+# フェイクバックエンド
+# ==========================================
+
+class FakeBackend:
+    """平均 latency_ms（±jitter）で応答するフェイク推論バックエンド"""
+
+    def __init__(self, latency_ms=500.0, jitter_ms=100.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def respond(self):
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms))
+        time.sleep(delay / 1000)
+        return json.dumps(FAKE_RESULT, ensure_ascii=False)
+
+
+def install_fake_backend(app_path, backend):
+    """
+    アプリの推論部分をフェイクに差し替える
+
+    Returns:
+        list: 終了時に stop() するパッチャーのリスト
+    """
+    patchers = []
+    app_dir = os.path.dirname(os.path.abspath(app_path))
+    if app_dir not in sys.path:
+        sys.path.insert(0, app_dir)
+
+    if os.path.basename(app_path).startswith("app_local"):
+        import adapter_registry
+
+        class FakeRegistry:
+            def __init__(self, base_model, tokenizer, adapter_paths, max_loaded=3):
+                self.model = None
+                self.base_model = base_model
+                self.tokenizer = tokenizer
+                self.adapter_paths = adapter_paths
+                self.max_loaded = max_loaded
+                self.generate_defaults = {}
+                self.pad_to_multiple_of = None
+
+            def activate(self, name):
+                return 0.0
+
+            def generate(self, name, prompts, num_return_sequences=1, **kwargs):
+                # 実物と同じく、プロンプトごとに num_return_sequences 件の候補を返す
+                return [backend.respond() for _ in prompts for _ in range(num_return_sequences)]
+
+            def stats(self):
+                return {"active": None, "loaded": {}, "switch_ms_p50": None, "switch_ms_max": None}
+
+        unsloth = types.ModuleType("unsloth")
+        unsloth.FastLanguageModel = types.SimpleNamespace(
+            from_pretrained=lambda **kwargs: (None, None),
+            for_inference=lambda model: None,
+        )
+        patchers += [
+            mock.patch.dict(sys.modules, {"unsloth": unsloth}),
+            mock.patch.object(adapter_registry, "AdapterRegistry", FakeRegistry),
+            mock.patch.dict(os.environ, {"BASE_MODEL_NAME": "fake"}),
+        ]
+    else:
+        import google.generativeai as genai
+
+        class FakeGenerativeModel:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def generate_content(self, prompt, **kwargs):
+                return types.SimpleNamespace(text=backend.respond())
+
+        env = {k: v for k, v in os.environ.items() if k not in ("GEMINI_ASYNC", "GEMINI_CONTEXT_CACHE")}
+        env["GOOGLE_API_KEY"] = "fake"
+        env["MODEL_RANKING_PATH"] = os.devnull
+        patchers += [
+            mock.patch.dict(os.environ, env, clear=True),
+            mock.patch.object(genai, "configure", lambda **kwargs: None),
+            mock.patch.object(genai, "GenerativeModel", FakeGenerativeModel),
+        ]
+
+    for p in patchers:
+        p.start()
+    return patchers
+
+
+# ==========================================
+# 仮想ユーザー（WebSocket クライアント）
+# ==========================================
+
+def process_rss_mb(pid):
+    """指定プロセスの常駐メモリ (MB)。Linux の /proc を参照"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return float("nan")
+
+
+class VirtualUser:
+    """1セッション分のブラウザ操作を WebSocket 経由で再現する"""
+
+    def __init__(self, base_url, rng, timeout=120):
+        self.ws_url = base_url.replace("http://", "ws://") + "/_stcore/stream"
+        self.rng = rng
+        self.timeout = timeout
+        self.ws = None
+        self.buttons = {}
+        self.errors = []  # 直近の実行で表示された st.error / 例外のメッセージ
+        self._stack = ExitStack()
+
+    def connect(self):
+        from websockets.sync.client import connect
+
+        self.ws = self._stack.enter_context(connect(
+            self.ws_url, subprotocols=["streamlit"], open_timeout=self.timeout, max_size=None))
+        self._rerun()
+        if not self.buttons:
+            reason = self.errors[0] if self.errors else "ボタンが描画されませんでした"
+            raise AppNotReady(f"アプリの初回実行に失敗しました: {reason}")
+
+    def close(self):
+        self._stack.close()
+        self.ws = None
+
+    def _rerun(self, widget_id=None):
+        """スクリプトの再実行を要求し、最終的な実行が完了するまで待つ"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = ""
+        if widget_id:
+            state = msg.rerun_script.widget_states.widgets.add()
+            state.id = widget_id
+            state.trigger_value = True
+        self.ws.send(msg.SerializeToString())
+
+        buttons, errors = {}, []
+        deadline = time.monotonic() + self.timeout
+        while True:
+            fwd = ForwardMsg()
+            fwd.ParseFromString(self.ws.recv(timeout=max(0.1, deadline - time.monotonic())))
+            kind = fwd.WhichOneof("type")
+            if kind == "delta" and fwd.delta.WhichOneof("type") == "new_element":
+                element = fwd.delta.new_element
+                element_type = element.WhichOneof("type")
+                if element_type == "button":
+                    buttons[element.button.id] = element.button.label
+                elif element_type == "exception":
+                    errors.append(f"{element.exception.type}: {element.exception.message}")
+                elif element_type == "alert" and element.alert.format == element.alert.ERROR:
+                    errors.append(element.alert.body)
+            elif kind == "script_finished":
+                if fwd.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    # st.rerun() による再実行。次の実行結果を待つ
+                    buttons, errors = {}, []
+                    continue
+                if fwd.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError("スクリプトのコンパイルに失敗しました")
+                self.buttons = buttons
+                self.errors = errors
+                return
+
+    def _timed(self, timings, step, action):
+        start = time.perf_counter()
+        action()
+        timings.append((step, time.perf_counter() - start))
+
+    def _click(self, step, predicate):
+        """
+        条件に合うボタンを1つクリック
+
+        Raises:
+            RuntimeError: 該当するボタンがない場合（シナリオは失敗として数え、計測値に含めない）
+        """
+        candidates = [wid for wid, label in self.buttons.items() if predicate(label)]
+        if not candidates:
+            detail = f" ({self.errors[0]})" if self.errors else ""
+            raise RuntimeError(f"{step}: 対象のボタンが見つかりません{detail}")
+        self._rerun(self.rng.choice(candidates))
+
+    def run_scenario(self):
+        """
+        Quick Demo → 診断実行 → 履歴閲覧 を1回実行
+
+        Returns:
+            list[tuple]: (ステップ名, 秒)
+        """
+        timings = []
+        if self.ws is None:
+            self._timed(timings, "open", self.connect)
+
+        self._timed(timings, "quick_demo", lambda: self._click(
+            "quick_demo", lambda label: label.startswith("事例")))
+        self._timed(timings, "submit", lambda: self._click("submit", lambda label: label == SUBMIT_LABEL))
+        self._timed(timings, "history", lambda: self._click(
+            "history", lambda label: label[:1] in ("🔴", "🟠", "🟢")))
+        return timings
+
+
+def run_level(base_url, server_pid, users, duration, seed=0):
+    """
+    users 人の仮想ユーザーを duration 秒間動かす
+
+    Returns:
+        dict: スループット・ステップ別レイテンシ・メモリ増加量
+            （アプリが起動できていない場合は failed に理由が入る）
+    """
+    timings, errors, failed = [], [], []
+    completed = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    rss_before = process_rss_mb(server_pid)
+
+    def worker(i):
+        user = VirtualUser(base_url, random.Random(seed + i))
+        while time.perf_counter() < deadline and not failed:
+            try:
+                result = user.run_scenario()
+            except AppNotReady as e:
+                with lock:
+                    failed.append(str(e))
+                break
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                user.close()
+                continue
+            with lock:
+                timings.extend(result)
+                completed[0] += 1
+        user.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    steps = {}
+    for step, seconds in timings:
+        steps.setdefault(step, []).append(seconds * 1000)
+    rss_after = process_rss_mb(server_pid)
+    return {
+        "users": users,
+        "scenarios": completed[0],
+        "errors": len(errors),
+        "throughput": completed[0] / elapsed,
+        "steps": {step: _percentiles(values) for step, values in steps.items()},
+        "rss_mb": round(rss_after, 1),
+        "rss_growth_mb": round(rss_after - rss_before, 1),
+        "first_error": errors[0] if errors else None,
+        "failed": failed[0] if failed else None,
+    }
+
+
+# ==========================================
+# サーバー起動
+# ==========================================
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app_path, latency_ms, jitter_ms, port=None, timeout=60):
+    """
+    フェイクバックエンド付きで対象アプリを `streamlit run` で起動
+
+    Returns:
+        tuple: (subprocess.Popen, base_url)
+    """
+    port = port or _free_port()
+    env = dict(os.environ, LOAD_TEST_APP=app_path, LOAD_TEST_LATENCY_MS=str(latency_ms),
+               LOAD_TEST_JITTER_MS=str(jitter_ms))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", os.path.join(CURRENT_DIR, "load_test_server.py"),
+         "--server.headless", "true", "--server.port", str(port), "--server.address", "127.0.0.1",
+         "--browser.gatherUsageStats", "false", "--server.fileWatcherType", "none"],
+        cwd=os.path.dirname(app_path), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/_stcore/health", timeout=1):
+                return proc, base_url
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError("Streamlit サーバーの起動に失敗しました")
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Streamlit サーバーの起動がタイムアウトしました")
+
+
+def _percentiles(values):
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(len(values) * q / 100))], 1)
+    return {"n": len(values), "p50": pick(50), "p95": pick(95), "p99": pick(99)}
+
+
+def find_saturation(results, min_gain=0.1, max_latency_ratio=2.0):
+    """
+    飽和が始まった同時ユーザー数を推定
+    スループットの伸びが min_gain 未満、または submit の p95 が初回の max_latency_ratio 倍を超えた段階
+    """
+    base = results[0]["steps"].get("submit", {}).get("p95")
+    for prev, cur in zip(results, results[1:]):
+        gain = (cur["throughput"] - prev["throughput"]) / prev["throughput"] if prev["throughput"] else 0
+        p95 = cur["steps"].get("submit", {}).get("p95")
+        if gain < min_gain or (base and p95 and p95 > base * max_latency_ratio):
+            return cur["users"]
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Streamlit アプリの同時接続負荷テスト")
+    parser.add_argument("--app", default=DEFAULT_APP, help="対象アプリのパス")
+    parser.add_argument("--users", type=int, default=16, help="最大同時ユーザー数（1から倍々に増加）")
+    parser.add_argument("--duration", type=float, default=10.0, help="各段階の実行秒数")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="フェイクバックエンドの平均応答時間")
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    args = parser.parse_args(argv)
+
+    app_path = os.path.abspath(args.app)
+    proc, base_url = start_server(app_path, args.latency_ms, args.jitter_ms)
+
+    levels, n = [], 1
+    while n < args.users:
+        levels.append(n)
+        n *= 2
+    levels.append(args.users)
+
+    results, status = [], 0
+    try:
+        print(f"🎯 対象: {app_path}  (バックエンド遅延 {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms)")
+        print(f"{'users':>5} {'scen/s':>7} {'err':>4} {'open p95':>9} {'demo p95':>9} "
+              f"{'submit p50':>11} {'submit p95':>11} {'hist p95':>9} {'RSS(MB)':>8} {'ΔRSS':>6}")
+        for users in levels:
+            r = run_level(base_url, proc.pid, users, args.duration)
+            results.append(r)
+            if r["failed"]:
+                print(f"{users:>5} ❌ {r['failed']}")
+                status = 1
+                break
+            step = lambda name, q: r["steps"].get(name, {}).get(q, float("nan"))
+            print(f"{users:>5} {r['throughput']:>7.2f} {r['errors']:>4} {step('open', 'p95'):>9.0f} "
+                  f"{step('quick_demo', 'p95'):>9.0f} {step('submit', 'p50'):>11.0f} "
+                  f"{step('submit', 'p95'):>11.0f} {step('history', 'p95'):>9.0f} "
+                  f"{r['rss_mb']:>8.0f} {r['rss_growth_mb']:>+6.0f}")
+            if r["first_error"]:
+                print(f"   ⚠️ {r['first_error']}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    if status:
+        print("\n❌ アプリが正常に動作していないため計測を中止しました")
+        return status
+
+    saturation = find_saturation(results)
+    print(f"\n📈 飽和開始: {f'{saturation} ユーザー' if saturation else '計測範囲内では未検出'}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"app": app_path, "latency_ms": args.latency_ms, "levels": results,
+                       "saturation_users": saturation}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
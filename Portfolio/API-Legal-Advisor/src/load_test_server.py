@@ -0,0 +1,30 @@
+"""
+負荷テスト用のサーバー側エントリーポイント
+load_test.py から `streamlit run` で起動され、推論バックエンドをフェイクに差し替えてから
+対象アプリ（LOAD_TEST_APP）を実行する
+"""
+
+import os
+import runpy
+import sys
+
+import load_test
+
+app_path = os.environ["LOAD_TEST_APP"]
+
+# Streamlit は再実行のたびにこのスクリプトのディレクトリを sys.path の先頭に入れるため、
+# 対象アプリのディレクトリを毎回先頭に戻し、アプリと同じモジュールが import されるようにする
+app_dir = os.path.dirname(os.path.abspath(app_path))
+if app_dir in sys.path:
+    sys.path.remove(app_dir)
+sys.path.insert(0, app_dir)
+
+# load_test モジュールは再実行をまたいで保持されるため、差し替えはプロセスで一度だけ行う
+if not getattr(load_test, "_backend_installed", False):
+    load_test.install_fake_backend(app_path, load_test.FakeBackend(
+        latency_ms=float(os.environ.get("LOAD_TEST_LATENCY_MS", "500")),
+        jitter_ms=float(os.environ.get("LOAD_TEST_JITTER_MS", "100")),
+    ))
+    load_test._backend_installed = True
+
+runpy.run_path(app_path, run_name="__main__")
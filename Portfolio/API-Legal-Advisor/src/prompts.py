@@ -0,0 +1,59 @@
+"""
+Guardian AI プロンプト定義モジュール
+固定の指示文（システムインストラクション）とユーザー仕様部分を分離して管理
+"""
+
+import json
+import os
+
+# 固定の指示文。Context Caching 利用時はこの部分がプロバイダ側にキャッシュされる
+GUARDIAN_INSTRUCTION = """
+あなたは「Guardian AI」という高度な法務リスク診断システムです。
+ユーザーから与えられる仕様の法的リスクを厳格に診断してください。
+
+【出力形式(JSON)】
+{
+    "risk_level": "High/Medium/Low",
+    "summary": "履歴表示用の一言サマリー（20文字以内）",
+    "laws": ["関連法1", "関連法2"],
+    "reason": "詳細な理由（専門的な観点から）",
+    "recommendations": ["推奨事項1", "推奨事項2", "推奨事項3"]
+}
+""".strip()
+
+
+def build_user_prompt(input_text):
+    """リクエストごとに送信するユーザー仕様部分を組み立てる"""
+    return f"【仕様】\n{input_text}"
+
+
+def build_prompt(input_text, reference_text=""):
+    """キャッシュを使わない場合の完全なプロンプトを組み立てる"""
+    parts = [GUARDIAN_INSTRUCTION]
+    if reference_text:
+        parts.append(f"【参考法令】\n{reference_text}")
+    parts.append(build_user_prompt(input_text))
+    return "\n\n".join(parts)
+
+
+def parse_json_response(text):
+    """モデル出力からコードフェンスを除去してJSONとして読み込む"""
+    text = text.replace("```json", "").replace("```", "").strip()
+    return json.loads(text)
+
+
+def load_reference_text(path=None):
+    """
+    法令プリアンブル（参考条文など）を読み込む
+
+    Args:
+        path: テキストファイルのパス。未指定時は環境変数 STATUTE_CONTEXT_PATH を参照
+
+    Returns:
+        str: 読み込んだテキスト（ファイルが無い場合は空文字）
+    """
+    path = path or os.environ.get("STATUTE_CONTEXT_PATH")
+    if not path or not os.path.exists(path):
+        return ""
+    with open(path, encoding="utf-8") as f:
+        return f.read().strip()
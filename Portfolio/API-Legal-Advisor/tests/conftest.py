@@ -0,0 +1,7 @@
+import os
+import sys
+
+# src/ のモジュールをそのまま import できるようにする（アプリと同じく src をカレントとして扱う）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import shared_path  # noqa: E402,F401
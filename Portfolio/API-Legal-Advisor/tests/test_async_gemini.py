@@ -0,0 +1,129 @@
+"""async_gemini の API キーの送り方・エラーメッセージ・ヘッジリクエストのテスト"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from async_gemini import AsyncGeminiClient, describe_error
+
+API_KEY = "AIza-secret-key"
+
+
+def make_client(handler, **kwargs):
+    client = AsyncGeminiClient(API_KEY, "gemini-2.5-flash", base_url="http://fake.test", **kwargs)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler), headers=client._client.headers)
+    return client
+
+
+def test_api_key_is_sent_in_header_not_url():
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "ok"}]}}]})
+
+    client = make_client(handler)
+    assert asyncio.run(client.generate("prompt")) == "ok"
+    assert seen[0].headers["x-goog-api-key"] == API_KEY
+    assert API_KEY not in str(seen[0].url)
+
+
+@pytest.mark.parametrize("status", [404, 429, 500])
+def test_http_error_message_does_not_leak_key(status):
+    client = make_client(lambda request: httpx.Response(status, json={"error": {"message": API_KEY}}))
+    with pytest.raises(httpx.HTTPStatusError) as info:
+        asyncio.run(client.generate("prompt"))
+
+    message = describe_error(info.value)
+    assert API_KEY not in message
+    assert f"HTTP {status}" in message
+
+
+def test_timeout_message_is_not_empty():
+    async def slow(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200, json={})
+
+    client = make_client(slow)
+    with pytest.raises(asyncio.TimeoutError) as info:
+        asyncio.run(client.generate("prompt", timeout=0.05))
+    assert describe_error(info.value) == "Gemini API の応答がタイムアウトしました"
+
+
+def test_connection_error_message():
+    def refuse(request):
+        raise httpx.ConnectError(f"connection refused: {request.url}", request=request)
+
+    client = make_client(refuse)
+    with pytest.raises(httpx.ConnectError) as info:
+        asyncio.run(client.generate("prompt"))
+    assert describe_error(info.value) == "Gemini API に接続できませんでした (ConnectError)"
+
+
+# ==========================================
+# ヘッジリクエスト
+# ==========================================
+
+OK = {"candidates": [{"content": {"parts": [{"text": "ok"}]}}]}
+
+
+def test_hedge_fires_after_delay_and_cancels_the_slow_request():
+    sent, cancelled = [], []
+
+    async def handler(request):
+        slow = b"slow" in request.content and not any(c == request.content for _, c in sent)
+        sent.append((time.perf_counter(), request.content))
+        try:
+            await asyncio.sleep(2.0 if slow else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(request.content)
+            raise
+        return httpx.Response(200, json=OK)
+
+    async def scenario():
+        client = make_client(handler, hedge=True, hedge_min_samples=5, hedge_max_ratio=0.5)
+        for i in range(5):
+            await client.generate(f"warmup {i}")
+        delay = client.hedge_delay()
+        sent.clear()
+        start = time.perf_counter()
+        assert await client.generate("slow") == "ok"
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(0.05)  # キャンセルが handler に届くのを待つ
+        return client, delay, elapsed
+
+    client, delay, elapsed = asyncio.run(scenario())
+    assert delay is not None
+    assert len(sent) == 2
+    assert sent[1][0] - sent[0][0] >= delay * 0.9
+    assert elapsed < 1.0
+    assert (client.hedge_count, client.hedge_wins) == (1, 1)
+    assert cancelled == [sent[0][1]]
+    # 記録される待ち時間は2本目の所要時間ではなく、採用した応答までの全体（ヘッジ待ちを含む）
+    assert client.latency._values[-1] >= delay + 0.01
+
+
+def test_hedges_stay_within_budget_and_delay_does_not_shrink():
+    seen = set()
+
+    async def handler(request):
+        first = request.content not in seen
+        seen.add(request.content)
+        await asyncio.sleep(0.3 if first and b"slow" in request.content else 0.01)
+        return httpx.Response(200, json=OK)
+
+    async def scenario():
+        # 遅い応答が p95 を押し上げない程度に速い応答を記録しておき、上限割合だけでヘッジが止まることを確認
+        client = make_client(handler, hedge=True, hedge_min_samples=5, hedge_max_ratio=0.02)
+        await asyncio.gather(*(client.generate(f"warmup {i}") for i in range(200)))
+        initial = client.hedge_delay()
+        for i in range(10):
+            await client.generate(f"slow {i}")
+            assert client.hedge_count <= client.hedge_max_ratio * client.request_count
+        return client, initial
+
+    client, initial = asyncio.run(scenario())
+    assert client.hedge_count == int(client.hedge_max_ratio * client.request_count)
+    assert client.hedge_delay() >= initial
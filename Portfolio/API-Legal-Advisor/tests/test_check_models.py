@@ -0,0 +1,49 @@
+"""check_models のランキング出力と読み込みのテスト（フェイクサーバーを使用）"""
+
+import json
+
+import check_models
+from check_models import load_ranked_model, main
+from gemini_rest import DEFAULT_BASE_URL
+
+
+def test_fake_run_writes_ranking(tmp_path):
+    output = tmp_path / "ranking.json"
+    code = main(["--fake", "--models", "gemini-2.5-flash", "gemini-2.5-pro",
+                 "--output", str(output), "--cache-dir", str(tmp_path / "cache")])
+
+    assert code == 0
+    config = json.loads(output.read_text(encoding="utf-8"))
+    assert config["recommended"] == "gemini-2.5-flash"
+    assert [m["model"] for m in config["models"]] == ["models/gemini-2.5-flash", "models/gemini-2.5-pro"]
+    assert all(m["eligible"] and m["error_rate"] == 0 for m in config["models"])
+    assert config["base_url"].startswith("http://127.0.0.1:")
+
+
+def test_fake_run_does_not_overwrite_production_ranking(tmp_path, monkeypatch):
+    production = tmp_path / "model_ranking.json"
+    production.write_text(json.dumps({"base_url": DEFAULT_BASE_URL, "recommended": "gemini-2.5-pro"}))
+    monkeypatch.setattr(check_models, "DEFAULT_RANKING_PATH", str(production))
+    monkeypatch.setattr(check_models, "FAKE_RANKING_PATH", str(tmp_path / "model_ranking.fake.json"))
+
+    assert main(["--fake", "--models", "gemini-2.5-flash", "--cache-dir", str(tmp_path / "cache")]) == 0
+    assert json.loads(production.read_text())["recommended"] == "gemini-2.5-pro"
+    assert (tmp_path / "model_ranking.fake.json").exists()
+
+
+def test_load_ranked_model_ignores_other_base_url(tmp_path, monkeypatch):
+    monkeypatch.delenv("GEMINI_API_BASE", raising=False)
+    path = tmp_path / "ranking.json"
+
+    path.write_text(json.dumps({"base_url": "http://127.0.0.1:8765", "recommended": "gemini-2.5-flash-lite"}))
+    assert load_ranked_model(str(path)) is None
+
+    path.write_text(json.dumps({"base_url": DEFAULT_BASE_URL, "recommended": "gemini-2.5-flash"}))
+    assert load_ranked_model(str(path)) == "gemini-2.5-flash"
+
+
+def test_load_ranked_model_missing_or_broken(tmp_path):
+    assert load_ranked_model(str(tmp_path / "missing.json")) is None
+    broken = tmp_path / "broken.json"
+    broken.write_text("{")
+    assert load_ranked_model(str(broken)) is None
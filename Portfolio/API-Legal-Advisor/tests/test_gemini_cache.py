@@ -0,0 +1,113 @@
+"""gemini_cache.PromptCache のキャッシュ作成・延長・フォールバックのテスト（LocalCacheBackend を使用）"""
+
+from gemini_cache import LocalCacheBackend, PromptCache
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FailingBackend(LocalCacheBackend):
+    """create が指定回数だけ失敗するバックエンド"""
+
+    def __init__(self, failures, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+
+    def create(self, *args, **kwargs):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("temporary network error")
+        return super().create(*args, **kwargs)
+
+
+def make_cache(backend, clock, **kwargs):
+    return PromptCache(backend, reference_text="個人情報保護法 第27条" * 50, ttl_seconds=600,
+                       refresh_margin_seconds=60, clock=clock, **kwargs)
+
+
+def test_cache_is_created_once_and_reused():
+    clock = FakeClock()
+    backend = LocalCacheBackend(clock=clock, sleep=lambda s: None)
+    cache = make_cache(backend, clock)
+
+    for _ in range(3):
+        _, usage = cache.generate("仕様")
+        assert usage.cached_tokens > 0
+    assert backend.create_count == 1
+    assert backend.refresh_count == 0
+
+
+def test_cache_is_refreshed_before_expiry():
+    clock = FakeClock()
+    backend = LocalCacheBackend(clock=clock, sleep=lambda s: None)
+    cache = make_cache(backend, clock)
+    cache.generate("仕様")
+
+    clock.now += 600 - 60 - 1  # 延長マージンの直前
+    cache.generate("仕様")
+    assert backend.refresh_count == 0
+
+    clock.now += 2  # 延長マージンに入った
+    _, usage = cache.generate("仕様")
+    assert backend.refresh_count == 1
+    assert backend.create_count == 1
+    assert usage.cached_tokens > 0
+    assert backend.expire_time(cache._handle) == clock.now + 600
+
+
+def test_expired_cache_is_recreated():
+    clock = FakeClock()
+    backend = LocalCacheBackend(clock=clock, sleep=lambda s: None)
+    cache = make_cache(backend, clock)
+    cache.generate("仕様")
+    backend.delete(cache._handle)  # プロバイダ側で削除された
+
+    clock.now += 590
+    _, usage = cache.generate("仕様")
+    assert backend.create_count == 2
+    assert usage.cached_tokens > 0
+
+
+def test_falls_back_to_uncached_when_creation_fails():
+    clock = FakeClock()
+    backend = FailingBackend(failures=1, clock=clock, sleep=lambda s: None)
+    cache = make_cache(backend, clock, retry_seconds=30)
+
+    text, usage = cache.generate("仕様")
+    assert text == backend.response_text
+    assert usage.cached_tokens == 0
+    assert usage.prompt_tokens > 0
+
+
+def test_creation_is_retried_after_backoff():
+    clock = FakeClock()
+    backend = FailingBackend(failures=2, clock=clock, sleep=lambda s: None)
+    cache = make_cache(backend, clock, retry_seconds=30, max_retry_seconds=300)
+
+    assert cache.generate("仕様")[1].cached_tokens == 0  # 1回目の失敗 -> 30秒待ち
+    clock.now += 29
+    assert cache.generate("仕様")[1].cached_tokens == 0  # 待機中は再試行しない
+    clock.now += 1
+    assert cache.generate("仕様")[1].cached_tokens == 0  # 2回目の失敗 -> 60秒待ち
+    clock.now += 59
+    assert cache.generate("仕様")[1].cached_tokens == 0
+    clock.now += 1
+    assert cache.generate("仕様")[1].cached_tokens > 0  # 復旧
+    assert backend.create_count == 1
+
+
+def test_close_deletes_cache():
+    clock = FakeClock()
+    backend = LocalCacheBackend(clock=clock, sleep=lambda s: None)
+    cache = make_cache(backend, clock)
+    cache.generate("仕様")
+    handle = cache._handle
+
+    cache.close()
+    assert cache._handle is None
+    assert handle not in backend._caches
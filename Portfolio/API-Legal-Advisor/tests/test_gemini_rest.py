@@ -0,0 +1,50 @@
+"""gemini_rest の API キーの送り方のテスト"""
+
+import io
+import json
+
+import gemini_rest
+from gemini_rest import GeminiRestClient
+
+API_KEY = "AIza-secret-key"
+
+
+class FakeResponse(io.BytesIO):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def capture(monkeypatch, payload):
+    seen = []
+
+    def urlopen(request, timeout=None):
+        seen.append(request)
+        return FakeResponse(json.dumps(payload).encode("utf-8"))
+
+    monkeypatch.setattr(gemini_rest.urllib.request, "urlopen", urlopen)
+    return seen
+
+
+def test_generate_sends_key_in_header(monkeypatch):
+    seen = capture(monkeypatch, {"candidates": [{"content": {"parts": [{"text": "ok"}]}}]})
+    client = GeminiRestClient(API_KEY, base_url="http://fake.test")
+    assert gemini_rest.extract_text(client.generate("gemini-2.5-flash", "prompt")) == "ok"
+
+    request = seen[0]
+    assert request.get_header("X-goog-api-key") == API_KEY
+    assert API_KEY not in request.full_url
+    assert request.full_url == "http://fake.test/v1beta/models/gemini-2.5-flash:generateContent"
+
+
+def test_list_models_sends_key_in_header(monkeypatch):
+    seen = capture(monkeypatch, {"models": [{"name": "models/gemini-2.5-flash"}]})
+    client = GeminiRestClient(API_KEY, base_url="http://fake.test")
+    assert client.list_models() == [{"name": "models/gemini-2.5-flash"}]
+
+    request = seen[0]
+    assert request.get_header("X-goog-api-key") == API_KEY
+    assert API_KEY not in request.full_url
+    assert "pageSize=1000" in request.full_url
@@ -0,0 +1,278 @@
+"""
+LoRAアダプタ・レジストリ
+ベースモデルを1つだけメモリに保持し、複数のドメイン別LoRAアダプタ（個人情報・下請法など）を
+遅延ロード・LRU方式で入れ替えながらリクエストごとに切り替える
+
+使い方（CPUでの動作確認）:
+    python adapter_registry.py
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+import shared_path  # noqa: F401
+from profiling import stage
+
+
+class AdapterRegistry:
+    """
+    1つのベースモデルに複数のLoRAアダプタを載せ替えるレジストリ
+
+    Args:
+        base_model: ベースモデル（transformers / Unsloth でロード済みのもの）
+        tokenizer: トークナイザ
+        adapter_paths: {アダプタ名: 保存先パス}
+        max_loaded: 同時にメモリに保持するアダプタ数の上限（超過時は最も古いものを破棄）
+    """
+
+    def __init__(self, base_model, tokenizer, adapter_paths, max_loaded=3):
+        if max_loaded < 1:
+            raise ValueError("max_loaded は1以上を指定してください")
+        self.base_model = base_model
+        self.tokenizer = tokenizer
+        self.adapter_paths = dict(adapter_paths)
+        self.max_loaded = max_loaded
+        self.model = None  # 最初のアダプタをロードした時点で PeftModel になる
+        self._loaded = OrderedDict()  # 名前 -> ロード時間(ms)、末尾ほど最近使用
+        self._active = None
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.switch_ms = []
+        # inference_opt.py から設定される生成オプション（静的キャッシュなど）とプロンプト長の丸め単位
+        self.generate_defaults = {}
+        self.pad_to_multiple_of = None
+
+    @property
+    def adapters(self):
+        return list(self.adapter_paths)
+
+    @property
+    def loaded(self):
+        return list(self._loaded)
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def device(self):
+        return next((self.model or self.base_model).parameters()).device
+
+    def _load(self, name):
+        from peft import PeftModel
+
+        start = time.perf_counter()
+        path = self.adapter_paths[name]
+        if self.model is None:
+            self.model = PeftModel.from_pretrained(self.base_model, path, adapter_name=name)
+        else:
+            self.model.load_adapter(path, adapter_name=name)
+        self.model.eval()
+        self._loaded[name] = (time.perf_counter() - start) * 1000
+
+    def _evict_if_needed(self, keep):
+        while len(self._loaded) > self.max_loaded:
+            victim = next(n for n in self._loaded if n != keep)
+            self.model.delete_adapter(victim)
+            del self._loaded[victim]
+            self.evictions += 1
+
+    def activate(self, name):
+        """
+        アダプタを有効化（未ロードならロードし、必要に応じて古いアダプタを破棄）
+
+        Returns:
+            float: 切り替えにかかった時間 (ms)
+        """
+        if name not in self.adapter_paths:
+            raise KeyError(f"未登録のアダプタです: {name}")
+        with self._lock:
+            start = time.perf_counter()
+            if name in self._loaded:
+                self.hits += 1
+                self._loaded.move_to_end(name)
+            else:
+                self.misses += 1
+                self._load(name)
+            if self._active != name:
+                self.model.set_adapter(name)
+                self._active = name
+            self._evict_if_needed(keep=name)
+            elapsed = (time.perf_counter() - start) * 1000
+            self.switch_ms.append(elapsed)
+            return elapsed
+
+    def _generate_locked(self, prompts, **generate_kwargs):
+        tokenizer = self.tokenizer
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = "left"
+        with stage("tokenize"):
+            inputs = tokenizer(prompts, return_tensors="pt", padding=True,
+                               pad_to_multiple_of=self.pad_to_multiple_of).to(self.device)
+        with stage("generate"), torch.no_grad():
+            outputs = self.model.generate(**inputs, **{**self.generate_defaults, **generate_kwargs})
+        # 入力部分を除いた生成トークンのみをデコード
+        with stage("decode"):
+            return tokenizer.batch_decode(outputs[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+
+    def generate(self, name, prompts, **generate_kwargs):
+        """指定アダプタで prompts をまとめて生成"""
+        with self._lock:
+            with stage("adapter_switch"):
+                self.activate(name)
+            return self._generate_locked(list(prompts), **generate_kwargs)
+
+    def generate_batch(self, requests, **generate_kwargs):
+        """
+        複数アダプタ宛てのリクエストをアダプタごとにまとめて生成
+
+        Args:
+            requests: [(アダプタ名, プロンプト), ...]
+
+        Returns:
+            list[str]: 入力と同じ順序の生成結果
+        """
+        groups = OrderedDict()
+        for i, (name, prompt) in enumerate(requests):
+            groups.setdefault(name, []).append((i, prompt))
+
+        results = [None] * len(requests)
+        with self._lock:
+            # ロード済みのアダプタから処理して入れ替え回数を抑える
+            order = sorted(groups, key=lambda n: n not in self._loaded)
+            for name in order:
+                indices, prompts = zip(*groups[name])
+                for i, text in zip(indices, self.generate(name, prompts, **generate_kwargs)):
+                    results[i] = text
+        return results
+
+    def memory_usage(self):
+        """ロード済みアダプタごとのパラメータメモリ (bytes)"""
+        usage = {name: 0 for name in self._loaded}
+        if self.model is None:
+            return usage
+        for param_name, param in self.model.named_parameters():
+            for name in usage:
+                if f".{name}." in param_name:
+                    usage[name] += param.numel() * param.element_size()
+        return usage
+
+    def stats(self):
+        """メモリ使用量・ロード時間・切り替えレイテンシの集計"""
+        switches = sorted(self.switch_ms)
+        memory = self.memory_usage()
+        return {
+            "active": self._active,
+            "loaded": {
+                name: {"memory_mb": round(memory.get(name, 0) / 2**20, 3), "load_ms": round(load_ms, 1)}
+                for name, load_ms in self._loaded.items()
+            },
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "switch_ms_p50": round(switches[len(switches) // 2], 3) if switches else None,
+            "switch_ms_max": round(switches[-1], 3) if switches else None,
+        }
+
+
+# ==========================================
+# CPUでの動作確認用（小さなベースモデルとダミーアダプタ）
+# ==========================================
+
+def build_toy_setup(workdir, adapter_names=("privacy", "subcontract", "copyright"), hidden_size=64, num_layers=2):
+    """
+    ランダム初期化の小型 Llama とダミーアダプタを作成する
+
+    Returns:
+        tuple: (base_model, tokenizer, {アダプタ名: パス})
+    """
+    import os
+    from peft import LoraConfig, get_peft_model
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    vocab = {"<pad>": 0, "<eos>": 1, "<unk>": 2}
+    for ch in "abcdefghijklmnopqrstuvwxyz0123456789":
+        vocab[ch] = len(vocab)
+    raw = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    raw.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=raw, pad_token="<pad>", eos_token="<eos>",
+                                        unk_token="<unk>")
+
+    config = LlamaConfig(vocab_size=len(vocab), hidden_size=hidden_size, intermediate_size=hidden_size * 2,
+                         num_hidden_layers=num_layers, num_attention_heads=4, num_key_value_heads=4,
+                         pad_token_id=0, eos_token_id=1, bos_token_id=1)
+    torch.manual_seed(0)
+    base = LlamaForCausalLM(config).eval()
+
+    paths = {}
+    for i, name in enumerate(adapter_names):
+        torch.manual_seed(i + 1)
+        lora = LoraConfig(r=8, lora_alpha=16, target_modules=["q_proj", "v_proj"], init_lora_weights=False)
+        peft_model = get_peft_model(LlamaForCausalLM(config), lora)
+        paths[name] = os.path.join(workdir, name)
+        peft_model.save_pretrained(paths[name])
+    return base, tokenizer, paths
+
+
+def sampling_latency(k, max_new_tokens=32, runs=3):
+    """
+    小型 Llama で num_return_sequences=k のバッチ生成と逐次 k 回の生成時間 (ms) を比較
+    （self-consistency の候補生成をバッチにした場合の効果の確認用）
+    """
+    import tempfile
+
+    kwargs = dict(max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens, do_sample=True, temperature=0.7)
+    with tempfile.TemporaryDirectory() as workdir:
+        base, tokenizer, paths = build_toy_setup(workdir, hidden_size=256, num_layers=4)
+        registry = AdapterRegistry(base, tokenizer, paths, max_loaded=1)
+        name = next(iter(paths))
+        registry.generate(name, ["case123"], **kwargs)  # 初回のオーバーヘッドを除外
+        modes = {
+            "sequential": lambda: [registry.generate(name, ["case123"], **kwargs)[0] for _ in range(k)],
+            "batched": lambda: registry.generate(name, ["case123"], num_return_sequences=k, **kwargs),
+        }
+        result = {"k": k}
+        for mode, run in modes.items():
+            times = []
+            for _ in range(runs):
+                torch.manual_seed(0)
+                start = time.perf_counter()
+                outputs = run()
+                times.append((time.perf_counter() - start) * 1000)
+            assert len(outputs) == k
+            result[mode] = sorted(times)[len(times) // 2]
+    return result
+
+
+if __name__ == "__main__":
+    import json
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as workdir:
+        base, tokenizer, paths = build_toy_setup(workdir)
+        registry = AdapterRegistry(base, tokenizer, paths, max_loaded=2)
+        base_mb = sum(p.numel() * p.element_size() for p in base.parameters()) / 2**20
+
+        requests = [(name, f"case{i}") for i, name in enumerate(
+            ["privacy", "subcontract", "privacy", "copyright", "subcontract", "privacy"])]
+        outputs = registry.generate_batch(requests, max_new_tokens=8, do_sample=False)
+        for (name, prompt), out in zip(requests, outputs):
+            print(f"[{name:<11}] {prompt} -> {out!r}")
+
+        for name in ["privacy", "privacy", "copyright"]:
+            print(f"switch to {name}: {registry.activate(name):.2f} ms")
+        print(f"base model: {base_mb:.2f} MB")
+        print(json.dumps(registry.stats(), ensure_ascii=False, indent=2))
+
+    print("\nnum_return_sequences=k のバッチ生成 vs 逐次 k 回 (ms)")
+    for k in (1, 3, 5):
+        r = sampling_latency(k)
+        print(f"{k:>3} sequential={r['sequential']:>8.1f}  batched={r['batched']:>8.1f}  "
+              f"({r['sequential'] / r['batched']:.1f}x)")
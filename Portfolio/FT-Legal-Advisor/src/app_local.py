@@ -3,12 +3,42 @@ from unsloth import FastLanguageModel
 import torch
 import json
 import os
+import time
+import uuid
 from datetime import datetime
+from functools import partial
+
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from adapter_registry import AdapterRegistry
+from inference_scheduler import DeadlineExceeded, InferenceScheduler
+from inference_opt import InferenceOptions, apply_inference_options
+import shared_path  # noqa: F401
+from citation_index import PLACEHOLDERS, STATUS_LABELS, load_default_index, split_laws
+from history_store import HistoryStore, history_to_parquet_bytes, history_to_record
+from profiling import Profiler, stage
+from self_consistency import DEFAULT_SAMPLES, DEFAULT_TEMPERATURE, SAMPLE_OPTIONS, aggregate, consistency_caption
+
+profiler = Profiler.from_env()
+citation_index = load_default_index()
 
 # ==========================================
 # パス設定 (環境に合わせて修正してください)
 # ==========================================
 MODEL_PATH = "/content/drive/MyDrive/Llama3_FineTune/lora_model_llama3_final"
+# ドメイン別LoRAアダプタ (ベースモデルは共通のものを1つだけロード)
+ADAPTER_PATHS = {
+    "汎用": MODEL_PATH,
+    # "個人情報": "/content/drive/MyDrive/Llama3_FineTune/lora_model_privacy",
+    # "下請法": "/content/drive/MyDrive/Llama3_FineTune/lora_model_subcontract",
+}
+DEFAULT_ADAPTER = "汎用"
+MAX_LOADED_ADAPTERS = 2  # 同時にメモリに載せるアダプタ数
+# 画面からの推論要求がこの秒数以内に開始できない場合は破棄する
+INTERACTIVE_DEADLINE_S = float(os.environ.get("INFERENCE_DEADLINE_S", "120"))
+# Attention 実装・静的キャッシュ・torch.compile・int8 量子化 (INFERENCE_* 環境変数で切り替え)
+INFERENCE_OPTIONS = InferenceOptions.from_env()
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 ASSETS_DIR = os.path.join(CURRENT_DIR, 'assets') 
 
@@ -36,6 +66,10 @@ if 'current_result' not in st.session_state:
     st.session_state.current_result = None
 if 'current_input' not in st.session_state:
     st.session_state.current_input = ""
+if 'adapter' not in st.session_state:
+    st.session_state.adapter = DEFAULT_ADAPTER
+if 'num_samples' not in st.session_state:
+    st.session_state.num_samples = DEFAULT_SAMPLES
 
 # ==========================================
 # CSSデザイン
@@ -157,6 +191,12 @@ st.markdown("""
         margin: 0 6px 6px 0;
     }
 
+    .law-tag-unknown {
+        background-color: #fef2f2;
+        color: #b91c1c;
+        border: 1px dashed #fca5a5;
+    }
+
     /* Streamlit標準のsubheaderのスタイルを上書きして統一 */
     h3 {
         font-size: 1.5rem !important;
@@ -198,50 +238,112 @@ def render_sidebar_label(text, icon=""):
 # AIモデル設定 (Llama-3 Local)
 # ==========================================
 
+def get_base_model_name():
+    """共通のベースモデル名を取得 (BASE_MODEL_NAME 未設定時は adapter_config.json から読み取る)"""
+    if os.environ.get("BASE_MODEL_NAME"):
+        return os.environ["BASE_MODEL_NAME"]
+    with open(os.path.join(ADAPTER_PATHS[DEFAULT_ADAPTER], "adapter_config.json")) as f:
+        return json.load(f)["base_model_name_or_path"]
+
 @st.cache_resource
 def load_local_model():
-    print(f"Loading Model from: {MODEL_PATH}")
+    base_model_name = get_base_model_name()
+    print(f"Loading Base Model: {base_model_name}")
     model, tokenizer = FastLanguageModel.from_pretrained(
-        model_name = MODEL_PATH,
+        model_name = base_model_name,
         max_seq_length = 4096,
         dtype = None,
         load_in_4bit = True,
     )
-    FastLanguageModel.for_inference(model)
-    return model, tokenizer
+    registry = AdapterRegistry(model, tokenizer, ADAPTER_PATHS, max_loaded=MAX_LOADED_ADAPTERS)
+    print(f"Loading Adapter: {ADAPTER_PATHS[DEFAULT_ADAPTER]}")
+    registry.activate(DEFAULT_ADAPTER)
+    FastLanguageModel.for_inference(registry.model)
+    info = apply_inference_options(registry, INFERENCE_OPTIONS)
+    print(f"Inference Options: {info}")
+    return registry
 
 try:
     with st.spinner('Guardian AI (Local Core) を起動中...'):
-        model, tokenizer = load_local_model()
+        registry = load_local_model()
 except Exception as e:
     st.error(f"モデルの読み込みに失敗しました。\nパス: {MODEL_PATH}\nエラー: {e}")
     st.stop()
 
-def call_local_model(input_text):
+def build_local_prompt(input_text):
     system_prompt = "IT法務コンサルタントとして回答してください。"
-    prompt = f"""<|start_header_id|>system<|end_header_id|>
+    return f"""<|start_header_id|>system<|end_header_id|>
 
 {system_prompt}<|eot_id|><|start_header_id|>user<|end_header_id|>
 
 {input_text}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
 """
-    inputs = tokenizer([prompt], return_tensors = "pt").to("cuda")
 
-    outputs = model.generate(
-        **inputs, 
+def run_local_model(job):
+    """スケジューラのワーカースレッド上で1件分の推論を実行（候補数分の出力テキストのリストを返す）"""
+    with stage("prompt_build"):
+        prompt = build_local_prompt(job["input_text"])
+    num_samples = job.get("num_samples", 1)
+    if num_samples > 1:
+        # 複数候補は num_return_sequences で1回のバッチ生成にまとめる（逐次 k 回の生成より大幅に速い）
+        sampling = dict(do_sample = True, temperature = DEFAULT_TEMPERATURE, num_return_sequences = num_samples)
+    else:
+        sampling = dict(temperature = 0.1)
+    result_texts = registry.generate(
+        job["adapter"],
+        [prompt],
         max_new_tokens = 512, 
         use_cache = True,
-        temperature = 0.1,
+        **sampling,
+    )
+    return [text.replace("<|eot_id|>", "").strip() for text in result_texts]
+
+def is_session_alive(session_id):
+    return runtime.exists() and runtime.get_instance().is_active_session(session_id)
+
+@st.cache_resource
+def get_scheduler():
+    # モデルは全セッションで共有するため、推論は1本のワーカーで優先度順に処理する
+    return InferenceScheduler(run_local_model, session_alive=is_session_alive)
+
+scheduler = get_scheduler()
+
+@st.cache_resource
+def get_history_store():
+    """GUARDIAN_HISTORY_DIR が設定されている場合のみ、診断履歴を Parquet に追記するストアを返す"""
+    root = os.environ.get("GUARDIAN_HISTORY_DIR")
+    return HistoryStore(root) if root else None
+
+def call_local_model(input_text, adapter=DEFAULT_ADAPTER, priority="interactive", num_samples=1):
+    ctx = get_script_run_ctx()
+    session_id = ctx.session_id if ctx else None
+    ticket = scheduler.submit(
+        {"input_text": input_text, "adapter": adapter, "num_samples": num_samples},
+        user_id = session_id or "anonymous",
+        session_id = session_id,
+        priority = priority,
+        deadline_s = INTERACTIVE_DEADLINE_S if priority == "interactive" else None,
     )
-    result_text = tokenizer.batch_decode(outputs)[0]
-    return result_text.split("<|start_header_id|>assistant<|end_header_id|>")[-1].replace("<|eot_id|>", "").strip()
+    return ticket.result()
 
 def parse_model_output(raw_text):
+    with stage("json_parse"):
+        return _parse_model_output(raw_text)
+
+def parse_model_outputs(raw_texts):
+    """候補が複数ある場合はそれぞれをパースし、多数決で1つの結果にまとめる"""
+    if len(raw_texts) == 1:
+        return parse_model_output(raw_texts[0])
+    candidates = [parse_model_output(text) for text in raw_texts]
+    with stage("vote"):
+        return aggregate(candidates)
+
+def _parse_model_output(raw_text):
     try:
         data = json.loads(raw_text)
         return {
             "risk_level": data.get("リスクレベル", "Medium"),
-            "laws": [data.get("該当法", "不明")],
+            "laws": split_laws(data.get("該当法", "不明")),
             "reason": data.get("理由", "詳細な理由を取得できませんでした。"),
             "recommendations": [data.get("修正案", "修正案を取得できませんでした。")]
         }
@@ -257,6 +359,24 @@ def parse_model_output(raw_text):
 # 結果表示ロジック
 # ==========================================
 
+def render_law_tags(laws):
+    """関連法規を法令インデックスで検証してタグ表示（確認できない引用は警告付き）"""
+    if isinstance(laws, str): laws = [laws]
+    tags, unknown = [], 0
+    for law in laws:
+        if law in PLACEHOLDERS:
+            tags.append(f'<span class="law-tag">{law}</span>')
+            continue
+        for citation in citation_index.check_all(law):
+            if citation.valid:
+                tags.append(f'<span class="law-tag">{citation.canonical}</span>')
+            else:
+                unknown += 1
+                tags.append(f'<span class="law-tag law-tag-unknown" title="{STATUS_LABELS[citation.status]}">⚠️ {citation.canonical}</span>')
+    st.markdown("".join(tags), unsafe_allow_html=True)
+    if unknown:
+        st.caption("⚠️ 付きの引用は法令データで確認できませんでした。条文番号を原典で確認してください。")
+
 def render_result(result_dict):
     if not result_dict: return
 
@@ -272,13 +392,13 @@ def render_result(result_dict):
     </div>
     """
     st.markdown(html, unsafe_allow_html=True)
+    caption = consistency_caption(result_dict)
+    if caption:
+        st.caption(caption)
 
     # 関連法規
     render_icon_header("関連法規", "icon_laws.png")
-    laws = result_dict.get('laws', [])
-    if isinstance(laws, str): laws = [laws]
-    laws_html = "".join([f'<span class="law-tag">{law}</span>' for law in laws])
-    st.markdown(laws_html, unsafe_allow_html=True)
+    render_law_tags(result_dict.get('laws', []))
     
     st.markdown("") 
 
@@ -307,6 +427,27 @@ with st.sidebar:
     else:
         st.markdown("## 🛡️ Guardian AI")
 
+    if len(ADAPTER_PATHS) > 1:
+        render_sidebar_label("Domain Adapter", "🧩")
+        st.selectbox("ドメインアダプタ", list(ADAPTER_PATHS), key="adapter", label_visibility="collapsed")
+        stats = registry.stats()
+        for name, info in stats["loaded"].items():
+            st.caption(f"{'▶' if name == stats['active'] else '・'} {name}: {info['memory_mb']:.1f} MB (ロード {info['load_ms']:.0f} ms)")
+        if stats["switch_ms_p50"] is not None:
+            st.caption(f"切り替え p50: {stats['switch_ms_p50']:.1f} ms / max: {stats['switch_ms_max']:.1f} ms")
+
+    render_sidebar_label("Inference Queue", "⏳")
+    st.caption(f"推論設定: {INFERENCE_OPTIONS.label}")
+    queue = scheduler.metrics()
+    st.caption(f"待機中: 画面 {queue['queue_depth']['interactive']} 件 / バッチ {queue['queue_depth']['batch']} 件")
+    waits = queue["wait_ms"]["interactive"]
+    if waits["p95"] is not None:
+        st.caption(f"待ち時間 p50: {waits['p50']:.0f} ms / p95: {waits['p95']:.0f} ms")
+
+    render_sidebar_label("Self-Consistency", "🗳️")
+    st.select_slider("候補数 (多数決)", options=SAMPLE_OPTIONS, key="num_samples",
+                     help="num_return_sequences で複数の候補を1回のバッチ生成で作り、リスクレベルを多数決で決定します")
+
     render_sidebar_label("Quick Demo", "⚡")
     if st.button("事例: 偽装請負 (SES)"):
         st.session_state.current_input = "SESのエンジニアに対し、チャットで直接「明日は9時に来て」と指示を出したいです。効率のためです。"
@@ -342,12 +483,23 @@ with st.sidebar:
         st.caption("履歴なし")
         
     st.markdown("---")
+    if st.session_state.history:
+        st.download_button(
+            "📦 履歴をエクスポート (Parquet)",
+            # クリックされたときだけ Parquet に変換する（再実行のたびに変換しない）
+            data=partial(history_to_parquet_bytes, list(st.session_state.history), "local"),
+            file_name=f"guardian_history_{datetime.now().strftime('%Y%m%d_%H%M')}.parquet",
+            mime="application/octet-stream",
+        )
     if st.button("🗑️ 履歴クリア"):
         st.session_state.history = []
         st.session_state.current_result = None
         st.session_state.current_input = ""
         st.rerun()
 
+# URLに ?profile=1 を付けたリクエストは設定に関わらずプロファイリングする
+profile_requested = st.query_params.get("profile") == "1"
+
 # 修正箇所: タイトルを日本語に変更し、サイズはCSSで統一
 render_icon_header("新規診断", "icon_new.png")
 
@@ -366,23 +518,38 @@ if st.button("リスク判定を実行する", type="primary"):
         st.warning("テキストを入力してください。")
     else:
         result_dict = None
-        with st.spinner("Guardian AI (Llama-3) が推論中..."):
+        start = time.perf_counter()
+        with st.spinner("Guardian AI (Llama-3) が推論中..."), profiler.request("assessment", force=profile_requested):
             try:
-                raw_output = call_local_model(user_input)
-                result_dict = parse_model_output(raw_output)
+                raw_outputs = call_local_model(user_input, st.session_state.adapter,
+                                               num_samples=st.session_state.num_samples)
+                result_dict = parse_model_outputs(raw_outputs)
+            except DeadlineExceeded:
+                st.warning("推論キューが混雑しています。しばらくしてから再実行してください。")
             except Exception as e:
                 st.error(f"推論エラー: {e}")
+        latency_ms = (time.perf_counter() - start) * 1000
         
         if result_dict:
             summary = user_input[:12] + "..."
-            st.session_state.history.append({
+            created_at = datetime.now()
+            item = {
                 "input": user_input,
                 "result": result_dict,
                 "summary": summary,
-                "timestamp": datetime.now().strftime("%H:%M")
-            })
+                "id": uuid.uuid4().hex,
+                "created_at": created_at,
+                "timestamp": created_at.strftime("%H:%M"),
+                "latency_ms": round(latency_ms, 1),
+                "model": st.session_state.adapter,
+            }
+            st.session_state.history.append(item)
+            history_store = get_history_store()
+            if history_store:
+                history_store.append(history_to_record(item, "local"))
             st.session_state.current_result = result_dict
             st.rerun()
 
 if st.session_state.current_result:
-    render_result(st.session_state.current_result)
\ No newline at end of file
+    with profiler.request("render", force=profile_requested), stage("render"):
+        render_result(st.session_state.current_result)
\ No newline at end of file
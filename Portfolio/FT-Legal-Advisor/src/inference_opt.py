@@ -0,0 +1,273 @@
+"""
+ローカル推論の最適化レイヤー
+AdapterRegistry に対して、以下の最適化を個別に有効化する。
+
+    - Attention 実装の選択（sdpa: torch の scaled_dot_product_attention / eager）
+    - 静的 KV キャッシュ（キャッシュ長を固定し、プロンプト長を一定単位に丸めて形状を揃える）
+    - torch.compile（静的キャッシュ前提。起動時にプロンプト長ごとにウォームアップ）
+    - Linear 層の動的 int8 量子化（CPU のみ。LoRA の対象層は除外）
+
+設定（環境変数）:
+    INFERENCE_ATTENTION       sdpa / eager（未設定時はモデルの既定）
+    INFERENCE_STATIC_CACHE    1 で静的 KV キャッシュを使用
+    INFERENCE_COMPILE         1 で torch.compile（静的キャッシュも有効になる）
+    INFERENCE_INT8            1 で Linear 層を動的 int8 量子化（CPU のみ）
+    INFERENCE_MAX_CACHE_LEN   静的キャッシュの長さ（プロンプト + 生成トークン数の上限）
+    INFERENCE_WARMUP_LENGTHS  ウォームアップするプロンプト長（カンマ区切り）
+
+使い方（CPU での比較）:
+    python inference_opt.py
+"""
+
+import copy
+import itertools
+import json
+import os
+import time
+from dataclasses import dataclass, replace
+
+import torch
+
+
+@dataclass
+class InferenceOptions:
+    """推論最適化の設定（すべて既定で無効）"""
+    attention: str = None
+    static_cache: bool = False
+    compile: bool = False
+    int8: bool = False
+    max_cache_len: int = 1024
+    pad_to_multiple_of: int = 64
+    warmup_lengths: tuple = (64, 128, 192, 256)
+
+    def __post_init__(self):
+        if self.attention not in (None, "sdpa", "eager"):
+            raise ValueError(f"attention は sdpa / eager のいずれかを指定してください: {self.attention}")
+        # 生成ステップごとにキャッシュの形状が変わると再コンパイルが発生するため、compile は静的キャッシュ前提
+        if self.compile:
+            self.static_cache = True
+
+    @classmethod
+    def from_env(cls):
+        lengths = os.environ.get("INFERENCE_WARMUP_LENGTHS", "64,128,192,256")
+        return cls(
+            attention=os.environ.get("INFERENCE_ATTENTION") or None,
+            static_cache=os.environ.get("INFERENCE_STATIC_CACHE") == "1",
+            compile=os.environ.get("INFERENCE_COMPILE") == "1",
+            int8=os.environ.get("INFERENCE_INT8") == "1",
+            max_cache_len=int(os.environ.get("INFERENCE_MAX_CACHE_LEN", "1024")),
+            warmup_lengths=tuple(int(n) for n in lengths.split(",") if n.strip()),
+        )
+
+    @property
+    def enabled(self):
+        """いずれかの最適化が有効か"""
+        return bool(self.attention or self.static_cache or self.compile or self.int8)
+
+    @property
+    def label(self):
+        parts = [self.attention or "default"]
+        if self.int8:
+            parts.append("int8")
+        if self.compile:
+            parts.append("compile")
+        elif self.static_cache:
+            parts.append("static")
+        return "+".join(parts)
+
+
+def lora_target_modules(adapter_paths):
+    """登録済みアダプタの adapter_config.json から LoRA の対象モジュール名を集める"""
+    targets = set()
+    for path in adapter_paths.values():
+        config_path = os.path.join(path, "adapter_config.json")
+        if not os.path.exists(config_path):
+            continue
+        with open(config_path) as f:
+            modules = json.load(f).get("target_modules") or []
+        targets.update([modules] if isinstance(modules, str) else modules)
+    return targets
+
+
+def quantize_int8(model, skip_modules=()):
+    """
+    Linear 層を動的 int8 量子化（重みを int8 で保持し、実行時に活性化を量子化）
+
+    LoRA の対象層は量子化しない（peft がベース層の weight を参照するため）。
+    量子化後はアダプタを追加で読み込めないため、先に必要なアダプタをロードしておくこと。
+
+    Returns:
+        int: 量子化した層の数
+    """
+    from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+
+    skip = set(skip_modules) | {"lm_head"}
+    names = [
+        name for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear)
+        and not any(part in skip or part.startswith("lora_") for part in name.split("."))
+    ]
+    quantize_dynamic(model, {name: default_dynamic_qconfig for name in names}, inplace=True)
+    return len(names)
+
+
+def model_memory_mb(model):
+    """パラメータ・バッファ（量子化済みの重みを含む）のメモリ使用量 (MB)"""
+    def nbytes(value):
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):
+            return sum(nbytes(v) for v in value)
+        return 0
+
+    return sum(nbytes(v) for v in model.state_dict().values()) / 2**20
+
+
+def warmup(registry, options, adapters=None, max_new_tokens=2):
+    """
+    ウォームアップ用のプロンプト長ごとに生成を1回実行し、コンパイルを済ませる
+
+    Args:
+        adapters: 対象アダプタ（既定は現在のアダプタのみ。アダプタごとに別のグラフになる）
+
+    Returns:
+        float: 所要時間 (ms)
+    """
+    tokenizer = registry.tokenizer
+    token_id = tokenizer("a", add_special_tokens=False)["input_ids"][-1]
+    start = time.perf_counter()
+    with registry._lock:
+        for name in adapters or [registry.active]:
+            registry.activate(name)
+            for length in options.warmup_lengths:
+                input_ids = torch.full((1, length), token_id, device=registry.device)
+                # 実際のリクエストと同じく左パディングありのマスクにしておく
+                attention_mask = torch.ones_like(input_ids)
+                attention_mask[:, 0] = 0
+                with torch.no_grad():
+                    registry.model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                            max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens,
+                                            do_sample=False, **registry.generate_defaults)
+    return (time.perf_counter() - start) * 1000
+
+
+def apply_inference_options(registry, options, warmup_adapters=None):
+    """
+    AdapterRegistry に最適化を適用
+
+    Args:
+        registry: アダプタを1つ以上有効化済みの AdapterRegistry
+        options: InferenceOptions
+        warmup_adapters: compile 時にウォームアップするアダプタ（既定は現在のアダプタ）
+
+    Returns:
+        dict: 適用内容と所要時間
+    """
+    info = {"label": options.label}
+    if not options.enabled:
+        return info  # 既定（すべて無効）の場合はモデルに触れない
+
+    base = registry.base_model
+
+    if options.attention:
+        base.set_attn_implementation(options.attention)
+
+    if options.int8:
+        if registry.device.type != "cpu":
+            print(f"⚠️ int8 動的量子化は CPU のみ対応のためスキップします (device={registry.device})")
+        else:
+            # 量子化後は peft が新しいアダプタを読み込めないため、登録済みアダプタを先にすべてロードしておく
+            if len(registry.adapter_paths) > registry.max_loaded:
+                raise ValueError("int8 量子化を使う場合は max_loaded を登録アダプタ数以上にしてください "
+                                 f"({registry.max_loaded} < {len(registry.adapter_paths)})")
+            active = registry.active
+            for name in registry.adapter_paths:
+                registry.activate(name)
+            if active:
+                registry.activate(active)
+            start = time.perf_counter()
+            info["int8_layers"] = quantize_int8(base, lora_target_modules(registry.adapter_paths))
+            info["int8_ms"] = (time.perf_counter() - start) * 1000
+
+    if options.static_cache:
+        registry.generate_defaults.update(cache_implementation="static", max_cache_len=options.max_cache_len)
+        registry.pad_to_multiple_of = options.pad_to_multiple_of
+
+    if options.compile:
+        # プロンプト長 × アダプタごとにグラフが増えるため、再コンパイル上限を引き上げる
+        adapters = max(len(registry.adapter_paths), 1)
+        torch._dynamo.config.recompile_limit = max(
+            torch._dynamo.config.recompile_limit, (len(options.warmup_lengths) + 1) * adapters * 2)
+        base.forward = torch.compile(base.forward, dynamic=False)
+        info["warmup_ms"] = warmup(registry, options, warmup_adapters)
+
+    info["memory_mb"] = model_memory_mb(registry.model or base)
+    return info
+
+
+# ==========================================
+# ベンチマーク（小型モデルでの組み合わせ比較）
+# ==========================================
+
+def benchmark_matrix(hidden_size=256, num_layers=4, prompt="case123", max_new_tokens=64, runs=5,
+                     include_compile=True):
+    """
+    Attention 実装 × int8 × キャッシュ方式（dynamic / static / static+compile）の組み合わせごとに
+    tokens/s（runs 回の中央値）とモデルのメモリ使用量を計測
+
+    Returns:
+        list[dict]
+    """
+    import tempfile
+
+    from adapter_registry import AdapterRegistry, build_toy_setup
+
+    modes = [{}, {"static_cache": True}] + ([{"compile": True}] if include_compile else [])
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        base, tokenizer, paths = build_toy_setup(workdir, hidden_size=hidden_size, num_layers=num_layers)
+        for attention, int8, mode in itertools.product(("eager", "sdpa"), (False, True), modes):
+            options = replace(InferenceOptions(attention=attention, int8=int8, max_cache_len=256,
+                                               warmup_lengths=(64,)), **mode)
+            torch._dynamo.reset()
+            registry = AdapterRegistry(copy.deepcopy(base), tokenizer, paths, max_loaded=len(paths))
+            registry.activate("privacy")
+            row = {"label": options.label}
+            try:
+                info = apply_inference_options(registry, options)
+                kwargs = dict(max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens, do_sample=False)
+                registry.generate("privacy", [prompt], **kwargs)  # 初回のオーバーヘッドを除外
+                speeds = []
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    registry.generate("privacy", [prompt], **kwargs)
+                    speeds.append(max_new_tokens / (time.perf_counter() - start))
+                row.update(tokens_per_sec=sorted(speeds)[len(speeds) // 2], memory_mb=info["memory_mb"],
+                           warmup_ms=info.get("warmup_ms"))
+            except Exception as e:
+                row["error"] = f"{type(e).__name__}: {e}"[:120]
+            rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="推論最適化の組み合わせごとの tokens/s・メモリ比較（CPU）")
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-compile", action="store_true", help="torch.compile の組み合わせを省略")
+    args = parser.parse_args()
+
+    torch.set_num_threads(os.cpu_count() or 1)
+    rows = benchmark_matrix(args.hidden_size, args.layers, max_new_tokens=args.max_new_tokens, runs=args.runs,
+                            include_compile=not args.no_compile)
+    print(f"{'options':<24} {'tokens/s':>10} {'memory(MB)':>11} {'warmup(ms)':>11}")
+    for row in rows:
+        if "error" in row:
+            print(f"{row['label']:<24} ❌ {row['error']}")
+            continue
+        warm = f"{row['warmup_ms']:.0f}" if row["warmup_ms"] is not None else "-"
+        print(f"{row['label']:<24} {row['tokens_per_sec']:>10.1f} {row['memory_mb']:>11.2f} {warm:>11}")
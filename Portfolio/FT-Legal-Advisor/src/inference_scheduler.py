@@ -0,0 +1,388 @@
+"""
+ローカル推論スケジューラ
+共有モデル（@st.cache_resource）への推論要求を1本のワーカースレッドで順に処理する。
+
+    - 優先度クラス: interactive（画面操作） > batch（一括・バックグラウンド処理）
+    - 公平性: 同じクラス内ではユーザーごとのキューをラウンドロビンで処理
+    - 期限: 期限を過ぎた要求、または推定処理時間から期限に間に合わない要求は実行せずに破棄
+    - キャンセル: セッションが消えた要求はキューから除去
+    - 飢餓防止: batch の待ち時間が batch_max_wait を超えた場合は1件だけ先に処理
+
+使い方（シミュレーション）:
+    python inference_scheduler.py
+"""
+
+import contextvars
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+import shared_path  # noqa: F401
+from profiling import attach_thread
+
+PRIORITIES = ("interactive", "batch")
+
+
+class DeadlineExceeded(Exception):
+    """期限内に処理を開始できなかった"""
+
+
+class RequestCancelled(Exception):
+    """要求がキャンセルされた（セッション終了など）"""
+
+
+class Ticket:
+    """投入した推論要求の状態と結果を保持する"""
+
+    def __init__(self, request_id, payload, user_id, session_id, priority, deadline, submitted_at):
+        self.request_id = request_id
+        self.payload = payload
+        self.user_id = user_id
+        self.session_id = session_id
+        self.priority = priority
+        self.deadline = deadline
+        self.submitted_at = submitted_at
+        self.started_at = None
+        self.finished_at = None
+        self.status = "queued"
+        self.context = contextvars.copy_context()
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _finish(self, status, result=None, error=None, now=None):
+        self.status = status
+        self._result = result
+        self._error = error
+        self.finished_at = now
+        self._done.set()
+
+    @property
+    def wait_time(self):
+        """キュー内で待った時間（秒）"""
+        return self.started_at - self.submitted_at if self.started_at is not None else None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        処理結果を返す（完了まで待機）
+
+        Raises:
+            DeadlineExceeded: 期限切れで破棄された場合
+            RequestCancelled: キャンセルされた場合
+            TimeoutError: timeout 秒以内に完了しなかった場合
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"request {self.request_id} が {timeout} 秒以内に完了しませんでした")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class InferenceScheduler:
+    """
+    優先度・期限・公平性を考慮して推論要求を1件ずつ実行するスケジューラ
+
+    Args:
+        handler: payload を受け取り結果を返す関数（ワーカースレッド上で実行される）
+        session_alive: session_id を受け取り、セッションが生きているかを返す関数
+        batch_max_wait: batch 要求がこの秒数を超えて待った場合、interactive より先に1件処理する
+        metrics_window: 待ち時間の統計に使う直近の件数
+    """
+
+    def __init__(self, handler, session_alive=None, batch_max_wait=60.0, metrics_window=500,
+                 clock=time.monotonic, policy="priority"):
+        self.handler = handler
+        self.session_alive = session_alive
+        self.batch_max_wait = batch_max_wait
+        self.policy = policy  # "priority" または比較用の "fifo"
+        self._clock = clock
+        self._queues = {p: OrderedDict() for p in PRIORITIES}  # user_id -> deque[Ticket]
+        self._fifo = deque()
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._service_time = None  # 処理時間の指数移動平均（秒）
+        self._waits = {p: deque(maxlen=metrics_window) for p in PRIORITIES}
+        self._counts = {status: 0 for status in ("completed", "failed", "expired", "cancelled")}
+        self._running = True
+        self._worker = threading.Thread(target=self._run, daemon=True, name="inference-scheduler")
+        self._worker.start()
+
+    # ------------------------------------------
+    # 投入・キャンセル
+    # ------------------------------------------
+
+    def submit(self, payload, user_id, session_id=None, priority="interactive", deadline_s=None):
+        """
+        推論要求を投入
+
+        Args:
+            payload: handler に渡す値
+            user_id: 公平性の単位となるユーザーID
+            session_id: セッションID（セッション終了時のキャンセルに使用）
+            priority: "interactive" または "batch"
+            deadline_s: 投入からの期限（秒）。None の場合は無期限
+
+        Returns:
+            Ticket
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority は {PRIORITIES} のいずれかを指定してください: {priority}")
+        now = self._clock()
+        ticket = Ticket(next(self._ids), payload, user_id, session_id, priority,
+                        now + deadline_s if deadline_s is not None else None, now)
+        with self._cond:
+            if self.policy == "fifo":
+                self._fifo.append(ticket)
+            else:
+                self._queues[priority].setdefault(user_id, deque()).append(ticket)
+            self._cond.notify()
+        return ticket
+
+    def cancel(self, ticket):
+        """未実行の要求をキャンセル（実行中・完了済みの場合は False）"""
+        with self._cond:
+            if ticket.status != "queued":
+                return False
+            self._remove(ticket)
+            self._drop(ticket, "cancelled", RequestCancelled(f"request {ticket.request_id} はキャンセルされました"))
+            return True
+
+    def cancel_session(self, session_id):
+        """指定セッションの未実行要求をすべてキャンセルし、件数を返す"""
+        with self._cond:
+            targets = [t for t in self._iter_queued() if t.session_id == session_id]
+            for ticket in targets:
+                self._remove(ticket)
+                self._drop(ticket, "cancelled", RequestCancelled(f"セッション {session_id} が終了しました"))
+            return len(targets)
+
+    def shutdown(self):
+        with self._cond:
+            self._running = False
+            for ticket in list(self._iter_queued()):
+                self._remove(ticket)
+                self._drop(ticket, "cancelled", RequestCancelled("スケジューラが停止しました"))
+            self._cond.notify_all()
+        self._worker.join()
+
+    # ------------------------------------------
+    # キュー操作（self._cond を保持した状態で呼ぶ）
+    # ------------------------------------------
+
+    def _iter_queued(self):
+        yield from self._fifo
+        for users in self._queues.values():
+            for q in users.values():
+                yield from q
+
+    def _remove(self, ticket):
+        if self.policy == "fifo":
+            self._fifo.remove(ticket)
+            return
+        users = self._queues[ticket.priority]
+        q = users.get(ticket.user_id)
+        if q is not None:
+            q.remove(ticket)
+            if not q:
+                del users[ticket.user_id]
+
+    def _drop(self, ticket, status, error):
+        self._counts[status] += 1
+        ticket._finish(status, error=error, now=self._clock())
+
+    def _sweep(self, now):
+        """期限切れ・セッション終了の要求を除去"""
+        estimate = self._service_time or 0.0
+        for ticket in list(self._iter_queued()):
+            if ticket.deadline is not None and now + estimate > ticket.deadline:
+                self._remove(ticket)
+                self._drop(ticket, "expired", DeadlineExceeded(
+                    f"request {ticket.request_id} は期限内に処理を開始できませんでした"))
+            elif ticket.session_id is not None and self.session_alive is not None \
+                    and not self.session_alive(ticket.session_id):
+                self._remove(ticket)
+                self._drop(ticket, "cancelled", RequestCancelled(f"セッション {ticket.session_id} が終了しました"))
+
+    def _pop_class(self, priority):
+        """クラス内でユーザーをラウンドロビンしながら、各ユーザーの期限が近い要求から取り出す"""
+        users = self._queues[priority]
+        if not users:
+            return None
+        user_id, q = next(iter(users.items()))
+        ticket = min(q, key=lambda t: (t.deadline is None, t.deadline or 0, t.request_id))
+        q.remove(ticket)
+        del users[user_id]
+        if q:
+            users[user_id] = q  # 末尾に回す
+        return ticket
+
+    def _oldest_batch_wait(self, now):
+        heads = [q[0].submitted_at for q in self._queues["batch"].values() if q]
+        return now - min(heads) if heads else 0.0
+
+    def _next_ticket(self):
+        now = self._clock()
+        self._sweep(now)
+        if self.policy == "fifo":
+            return self._fifo.popleft() if self._fifo else None
+        if self._oldest_batch_wait(now) > self.batch_max_wait:
+            return self._pop_class("batch")
+        for priority in PRIORITIES:
+            ticket = self._pop_class(priority)
+            if ticket is not None:
+                return ticket
+        return None
+
+    # ------------------------------------------
+    # ワーカー
+    # ------------------------------------------
+
+    def _call_handler(self, payload):
+        # sampling / cprofile はスレッド単位のため、計測中ならこのワーカースレッドも対象に加える
+        with attach_thread():
+            return self.handler(payload)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                ticket = None
+                while self._running and ticket is None:
+                    ticket = self._next_ticket()
+                    if ticket is None:
+                        self._cond.wait(timeout=1.0)
+                if not self._running:
+                    return
+                ticket.status = "running"
+                ticket.started_at = self._clock()
+                self._waits[ticket.priority].append(ticket.wait_time)
+
+            try:
+                # 投入元のコンテキスト（プロファイリングなど）で実行
+                result = ticket.context.run(self._call_handler, ticket.payload)
+            except Exception as e:
+                with self._cond:
+                    self._counts["failed"] += 1
+                ticket._finish("failed", error=e, now=self._clock())
+                continue
+
+            now = self._clock()
+            elapsed = now - ticket.started_at
+            with self._cond:
+                self._service_time = elapsed if self._service_time is None \
+                    else 0.8 * self._service_time + 0.2 * elapsed
+                self._counts["completed"] += 1
+            ticket._finish("completed", result=result, now=now)
+
+    # ------------------------------------------
+    # メトリクス
+    # ------------------------------------------
+
+    def metrics(self):
+        """キュー長・待ち時間 (p50/p95)・処理件数を返す"""
+        with self._cond:
+            depth = {p: 0 for p in PRIORITIES}
+            for ticket in self._iter_queued():
+                depth[ticket.priority] += 1
+            waits = {p: sorted(w) for p, w in self._waits.items()}
+            counts = dict(self._counts)
+            service_time = self._service_time
+
+        def pct(values, q):
+            return round(values[min(len(values) - 1, int(len(values) * q / 100))] * 1000, 1) if values else None
+
+        return {
+            "queue_depth": depth,
+            "wait_ms": {p: {"p50": pct(w, 50), "p95": pct(w, 95)} for p, w in waits.items()},
+            "service_ms": round(service_time * 1000, 1) if service_time is not None else None,
+            **counts,
+        }
+
+
+# ==========================================
+# シミュレーション（バッチ大量投入時の interactive 待ち時間）
+# ==========================================
+
+class VirtualClock:
+    """
+    シミュレーション用の仮想時計（advance した分だけ進む）
+
+    処理時間を実際の sleep ではなく仮想時間で表すため、待ち時間がスレッドの実行タイミングに依存しない
+    """
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            return self._now
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += seconds
+
+
+def simulate(policy="priority", service_ms=10.0, batch_jobs=300, interactive_users=4,
+             interactive_per_user=15, think_ms=40.0, deadline_s=None, clock=None):
+    """
+    batch を大量投入した状態で、複数ユーザーが interactive 要求を断続的に送る
+
+    Args:
+        clock: VirtualClock を渡すと、処理時間を仮想時間で進める（think_ms の待機も省略）
+
+    Returns:
+        dict: interactive の待ち時間 p50/p95 (ms) とスケジューラのメトリクス
+    """
+    if clock is None:
+        handler, clock = (lambda payload: time.sleep(service_ms / 1000)), time.monotonic
+    else:
+        handler, think_ms = (lambda payload: clock.advance(service_ms / 1000)), 0.0
+    scheduler = InferenceScheduler(handler, clock=clock, policy=policy)
+    batch = [scheduler.submit(i, user_id="nightly-batch", priority="batch") for i in range(batch_jobs)]
+    waits, lock = [], threading.Lock()
+
+    def user(uid):
+        for i in range(interactive_per_user):
+            ticket = scheduler.submit(i, user_id=uid, session_id=uid, deadline_s=deadline_s)
+            try:
+                ticket.result()
+            except DeadlineExceeded:
+                pass
+            if ticket.wait_time is not None:
+                with lock:
+                    waits.append(ticket.wait_time * 1000)
+            if think_ms:
+                time.sleep(think_ms / 1000)
+
+    threads = [threading.Thread(target=user, args=(f"user-{u}",)) for u in range(interactive_users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    metrics = scheduler.metrics()
+    scheduler.shutdown()
+
+    waits.sort()
+    return {
+        "policy": policy,
+        "interactive_p50_ms": round(waits[len(waits) // 2], 1),
+        "interactive_p95_ms": round(waits[int(len(waits) * 0.95)], 1),
+        "batch_completed": sum(1 for t in batch if t.status == "completed"),
+        "metrics": metrics,
+    }
+
+
+if __name__ == "__main__":
+    service_ms = 10.0
+    for policy in ("fifo", "priority"):
+        r = simulate(policy=policy, service_ms=service_ms)
+        print(f"{policy:<9} interactive wait p50={r['interactive_p50_ms']:>7.1f} ms  "
+              f"p95={r['interactive_p95_ms']:>7.1f} ms  batch completed={r['batch_completed']}")
+    # interactive の p95 は「実行中の1件 + 他の interactive ユーザー分」程度に収まるはず
+    bound = service_ms * 4 * 2
+    assert r["interactive_p95_ms"] <= bound, f"interactive p95 {r['interactive_p95_ms']} ms > {bound} ms"
+    print(f"✅ priority: interactive p95 <= {bound:.0f} ms（バッチ 300 件投入中）")
@@ -0,0 +1,13 @@
+"""
+API 版・ローカル版で共通のモジュール（Portfolio/shared/）を import できるようにする
+
+    import shared_path  # noqa: F401  （共通モジュールの import より前に置く）
+"""
+
+import os
+import sys
+
+SHARED_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "shared"))
+
+if SHARED_DIR not in sys.path:
+    sys.path.append(SHARED_DIR)
@@ -0,0 +1,66 @@
+"""adapter_registry のテスト（小型のベースモデルとダミーアダプタで CPU 上で実行）"""
+
+import pytest
+
+from adapter_registry import AdapterRegistry, build_toy_setup
+
+GREEDY = dict(max_new_tokens=4, do_sample=False)
+
+
+@pytest.fixture(scope="module")
+def toy(tmp_path_factory):
+    return build_toy_setup(str(tmp_path_factory.mktemp("adapters")))
+
+
+@pytest.fixture
+def registry(toy):
+    base, tokenizer, paths = toy
+    registry = AdapterRegistry(base, tokenizer, paths, max_loaded=2)
+    yield registry
+    # ベースモデルはテスト間で共有するため、載せたアダプタを外して元に戻す
+    if registry.model is not None:
+        registry.model.unload()
+
+
+def test_adapters_are_loaded_lazily(registry):
+    assert registry.loaded == []
+    assert registry.model is None
+    registry.activate("privacy")
+    assert registry.loaded == ["privacy"]
+    assert registry.active == "privacy"
+
+
+def test_least_recently_used_adapter_is_evicted(registry):
+    for name in ["privacy", "subcontract", "privacy", "copyright"]:
+        registry.activate(name)
+    # privacy は直前に使われたため、最も古い subcontract が破棄される
+    assert registry.loaded == ["privacy", "copyright"]
+    assert (registry.hits, registry.misses, registry.evictions) == (1, 3, 1)
+    stats = registry.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 3, 1)
+    assert list(stats["loaded"]) == ["privacy", "copyright"]
+
+
+def test_unknown_adapter_is_rejected(registry):
+    with pytest.raises(KeyError):
+        registry.activate("tax")
+
+
+def test_generate_batch_keeps_request_order(registry):
+    requests = [("privacy", "case1"), ("copyright", "case2"), ("privacy", "case3"), ("subcontract", "case4")]
+    outputs = registry.generate_batch(requests, **GREEDY)
+    expected = [registry.generate(name, [prompt], **GREEDY)[0] for name, prompt in requests]
+    assert outputs == expected
+    # アダプタごとに異なる重みのため、同じ入力でも出力が変わる
+    assert len({registry.generate(name, ["case1"], **GREEDY)[0]
+                for name in ["privacy", "subcontract", "copyright"]}) > 1
+
+
+def test_memory_usage_matches_loaded_adapters(registry):
+    registry.activate("privacy")
+    registry.activate("subcontract")
+    usage = registry.memory_usage()
+    assert set(usage) == set(registry.loaded) == {"privacy", "subcontract"}
+    assert all(size > 0 for size in usage.values())
+    registry.activate("copyright")
+    assert set(registry.memory_usage()) == {"subcontract", "copyright"}
@@ -0,0 +1,82 @@
+"""inference_scheduler のテスト"""
+
+import glob
+import pstats
+import time
+
+from inference_scheduler import InferenceScheduler
+from profiling import Profiler, stage
+
+
+def slow_generate(payload):
+    with stage("generate"):
+        time.sleep(0.2)
+    return payload
+
+
+def test_worker_thread_is_profiled(tmp_path):
+    profiler = Profiler(mode="on", tools=["cprofile", "sampling"], output_dir=str(tmp_path), interval_ms=2)
+    scheduler = InferenceScheduler(slow_generate)
+    try:
+        with profiler.request("assessment"):
+            assert scheduler.submit("x", user_id="u1").result(timeout=10) == "x"
+    finally:
+        scheduler.shutdown()
+
+    stages = open(glob.glob(str(tmp_path / "*.stages.folded"))[0]).read()
+    assert "assessment;generate " in stages
+
+    samples = open(glob.glob(str(tmp_path / "*.sample.folded"))[0]).read()
+    assert "slow_generate (test_inference_scheduler.py" in samples
+
+    stats = pstats.Stats(glob.glob(str(tmp_path / "*.prof"))[0])
+    assert any(func[2] == "slow_generate" for func in stats.stats)
+
+
+# ==========================================
+# シミュレーション（仮想時計で実行し、スレッドのタイミングに依存しない）
+# ==========================================
+
+SERVICE_MS = 10.0
+USERS = 4
+
+
+def test_interactive_p95_is_bounded_under_batch_flood():
+    from inference_scheduler import VirtualClock, simulate
+
+    r = simulate(policy="priority", service_ms=SERVICE_MS, interactive_users=USERS, clock=VirtualClock())
+    # 各ユーザーの未処理要求は常に1件のため、待ち時間は「実行中の1件 + 他ユーザーの interactive 分」以内
+    assert r["interactive_p95_ms"] <= SERVICE_MS * USERS
+    assert r["metrics"]["completed"] >= USERS * 15
+
+
+
+def test_request_past_its_deadline_is_dropped():
+    import threading
+
+    from inference_scheduler import DeadlineExceeded, VirtualClock
+
+    clock, started, release = VirtualClock(), threading.Event(), threading.Event()
+
+    def handler(payload):
+        started.set()
+        release.wait(timeout=10)
+        clock.advance(1.0)
+        return payload
+
+    scheduler = InferenceScheduler(handler, clock=clock)
+    try:
+        first = scheduler.submit(1, user_id="u1")
+        started.wait(timeout=10)
+        late = scheduler.submit(2, user_id="u2", deadline_s=0.5)
+        release.set()
+        assert first.result(timeout=10) == 1
+        try:
+            late.result(timeout=10)
+            assert False, "期限切れの要求が実行された"
+        except DeadlineExceeded:
+            pass
+        assert late.status == "expired"
+        assert scheduler.metrics()["expired"] == 1
+    finally:
+        scheduler.shutdown()
@@ -0,0 +1,355 @@
+"""
+法令引用インデックス
+モデルが出力した「関連法規」の文字列（例: "民法第416条の2（不法行為）"）を解析し、
+法令リスト（statutes.json）と照合して正規化・検証する。LLM への再問い合わせは行わない。
+
+    - 法令名・略称・正式名称はトライ木で最長一致検索（1つの文字列に複数の法令があれば法令ごとに分割）
+    - 条・枝番（30条の4）・項・号を解析（全角数字・漢数字にも対応）
+    - 存在しない法令・条・項・号を検出
+
+使い方（スループット計測）:
+    python citation_index.py
+"""
+
+import json
+import os
+import re
+import time
+import unicodedata
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+STATUTES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "statutes.json")
+
+# 複数の法令を並べる区切り（条文内の「・」は号・項の列挙に使われるため対象外）
+LAW_SEPARATOR = re.compile(r"\s*[/／;；\n]\s*")
+# 「、」「,」は次が条・項・号（"第2号" など）でなく、括弧の外にある場合のみ法令の区切りとみなす
+LIST_SEPARATORS = "、,，"
+_BRACKETS = {"(": ")", "（": "）", "「": "」"}
+# 検証対象外のプレースホルダ（パース失敗時の "-" など）
+PLACEHOLDERS = {"-", "不明", "なし"}
+STATUS_LABELS = {
+    "ok": "確認済み",
+    "unknown_law": "法令データにない法令名",
+    "unknown_article": "存在しない条番号",
+    "unknown_paragraph": "存在しない項番号",
+    "unknown_item": "存在しない号番号",
+}
+
+_NUM = r"[0-9〇一二三四五六七八九十百千]+"
+_TOKEN = re.compile(
+    rf"(?P<article>第?({_NUM})条(?:の({_NUM}))?)|(?P<paragraph>第?({_NUM})項)|(?P<item>第?({_NUM})号)"
+)
+_KANJI_DIGITS = {"〇": 0, "一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_KANJI_UNITS = {"十": 10, "百": 100, "千": 1000}
+
+
+def to_int(text):
+    """算用数字・漢数字（"四百十六", "三十"）を整数に変換"""
+    if text.isdigit():
+        return int(text)
+    total, digit = 0, 0
+    for ch in text:
+        if ch in _KANJI_DIGITS:
+            digit = digit * 10 + _KANJI_DIGITS[ch]
+        else:
+            total += (digit or 1) * _KANJI_UNITS[ch]
+            digit = 0
+    return total + digit
+
+
+@dataclass(frozen=True)
+class Citation:
+    """1件の引用（法令名のみ、または条・項・号まで）"""
+    raw: str
+    law: str = None  # 正規化後の法令名（未知の場合は None）
+    article: int = None
+    branch: int = None  # 枝番（30条の4 の 4）
+    paragraph: int = None
+    items: tuple = ()
+    note: str = ""  # 括弧内の補足（"指揮命令の原則" など）
+    status: str = "ok"  # ok / unknown_law / unknown_article / unknown_paragraph / unknown_item
+
+    @property
+    def valid(self):
+        return self.status == "ok"
+
+    @property
+    def canonical(self):
+        """表示用の正規化表記（例: "著作権法第30条の4第1項第2号"）"""
+        if self.law is None:
+            return self.raw
+        text = self.law
+        if self.article is not None:
+            text += f"第{self.article}条" + (f"の{self.branch}" if self.branch else "")
+        if self.paragraph is not None:
+            text += f"第{self.paragraph}項"
+        if self.items:
+            text += "・".join(f"第{i}号" for i in self.items)
+        if self.note:
+            text += f"（{self.note}）"
+        return text
+
+
+@dataclass
+class _Law:
+    name: str
+    max_article: int
+    branches: dict = field(default_factory=dict)
+    paragraphs: dict = field(default_factory=dict)
+    items: dict = field(default_factory=dict)
+
+
+class CitationIndex:
+    """
+    法令名トライ木と条・項・号の範囲を保持し、引用を検証するインデックス
+
+    Args:
+        laws: statutes.json の "laws" に相当するリスト
+        cache_size: 解析結果をキャッシュする件数（同じ文字列の再検証を省略）
+    """
+
+    def __init__(self, laws, cache_size=4096):
+        self._trie = {}
+        self._laws = {}
+        for entry in laws:
+            law = _Law(
+                name=entry["name"],
+                max_article=entry["max_article"],
+                branches={int(k): v for k, v in entry.get("branches", {}).items()},
+                paragraphs=dict(entry.get("paragraphs", {})),
+                items=dict(entry.get("items", {})),
+            )
+            self._laws[law.name] = law
+            for alias in {entry["name"], entry.get("formal", entry["name"]), *entry.get("aliases", [])}:
+                self._insert(unicodedata.normalize("NFKC", alias), law.name)
+        self.check = lru_cache(maxsize=cache_size)(self._check)
+
+    @classmethod
+    def from_file(cls, path=STATUTES_PATH, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)["laws"], **kwargs)
+
+    @property
+    def laws(self):
+        return list(self._laws)
+
+    def _insert(self, key, name):
+        node = self._trie
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[None] = name  # 終端
+
+    def find_law(self, text, offset=0):
+        """
+        text[offset:] 中で最も左にある法令名を最長一致で探す
+
+        Returns:
+            tuple: (正規化後の法令名, 開始位置, 終了位置)。見つからない場合は (None, -1, -1)
+        """
+        trie = self._trie
+        for start in range(offset, len(text)):
+            node, match = trie, None
+            for pos in range(start, len(text)):
+                node = node.get(text[pos])
+                if node is None:
+                    break
+                if None in node:
+                    match = (node[None], start, pos + 1)
+            if match:
+                return match
+        return None, -1, -1
+
+    # ------------------------------------------
+    # 解析・検証
+    # ------------------------------------------
+
+    def _status(self, law, article, branch, paragraph, items):
+        if article < 1 or article > law.max_article:
+            return "unknown_article"
+        if branch is not None and not 2 <= branch <= law.branches.get(article, 0):
+            return "unknown_article"
+        key = f"{article}の{branch}" if branch else str(article)
+        if paragraph is not None and key in law.paragraphs and not 1 <= paragraph <= law.paragraphs[key]:
+            return "unknown_paragraph"
+        max_item = law.items.get(f"{key}-{paragraph or 1}")
+        if max_item is not None and any(not 1 <= i <= max_item for i in items):
+            return "unknown_item"
+        return "ok"
+
+    def _check(self, raw):
+        """1つの法令文字列を解析し、Citation のタプルを返す（複数の法令・条文を含む場合は複数）"""
+        text = re.sub(r"\s+", "", unicodedata.normalize("NFKC", raw))
+        matches = []
+        name, start, end = self.find_law(text)
+        while name is not None:
+            matches.append((name, start, end))
+            name, start, end = self.find_law(text, end)
+        if not matches:
+            return (Citation(raw=raw, status="unknown_law"),)
+
+        # 法令名ごとに、次の法令名までを条・項・号の範囲とする
+        citations = []
+        for i, (name, _, end) in enumerate(matches):
+            stop = matches[i + 1][1] if i + 1 < len(matches) else len(text)
+            citations.extend(self._parse_segment(raw, name, text[end:stop]))
+        return tuple(citations)
+
+    def _parse_segment(self, raw, name, rest):
+        """法令名に続く部分（rest）から条・項・号を解析"""
+        tokens = list(_TOKEN.finditer(rest))
+        # 括弧内の補足（条文番号以外）は note として保持
+        note = re.sub(r"[()（）「」]", "", _TOKEN.sub("", rest)).strip("・、,")
+        if not tokens:
+            return [Citation(raw=raw, law=name, note=note)]
+
+        law = self._laws[name]
+        parsed = []  # [article, branch, paragraph, items]
+        for m in tokens:
+            if m.group("article"):
+                parsed.append([to_int(m.group(2)), to_int(m.group(3)) if m.group(3) else None, None, []])
+            elif not parsed:
+                continue  # 条の前に現れた項・号は解釈できないため無視
+            elif m.group("paragraph"):
+                current = parsed[-1]
+                if current[2] is not None:  # 「第1項、第2項」は同じ条の別の項として扱う
+                    parsed.append([current[0], current[1], None, []])
+                parsed[-1][2] = to_int(m.group(5))
+            else:
+                parsed[-1][3].append(to_int(m.group(7)))
+
+        return [
+            Citation(raw=raw, law=name, article=article, branch=branch, paragraph=paragraph,
+                     items=tuple(items), note=note,
+                     status=self._status(law, article, branch, paragraph, items))
+            for article, branch, paragraph, items in parsed
+        ]
+
+    def check_all(self, laws):
+        """
+        モデル出力の laws（文字列またはリスト）をまとめて検証
+
+        Returns:
+            list[Citation]
+        """
+        if isinstance(laws, str):
+            laws = [laws]
+        citations = []
+        for entry in laws:
+            for part in split_laws(entry):
+                citations.extend(self.check(part))
+        return citations
+
+
+def split_laws(text):
+    """「A法 / B法」「A法、B法」のように1つの文字列に並んだ法令をリストに分割"""
+    parts = []
+    for part in LAW_SEPARATOR.split(str(text).strip()):
+        parts.extend(_split_list(part))
+    return [part for part in parts if part]
+
+
+def _split_list(text):
+    """括弧の外の「、」「,」で分割（次が "第2号" のような条・項・号の続きの場合は分割しない）"""
+    if not any(sep in text for sep in LIST_SEPARATORS):
+        return [text]
+    parts, start, closing = [], 0, []
+    for pos, ch in enumerate(text):
+        if ch in _BRACKETS:
+            closing.append(_BRACKETS[ch])
+        elif closing and ch == closing[-1]:
+            closing.pop()
+        elif ch in LIST_SEPARATORS and not closing:
+            following = unicodedata.normalize("NFKC", text[pos + 1:]).lstrip()
+            if not _TOKEN.match(following):
+                parts.append(text[start:pos].strip())
+                start = pos + 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+@lru_cache(maxsize=1)
+def load_default_index():
+    """同じディレクトリの statutes.json からインデックスを作成（プロセスで1回のみ）"""
+    return CitationIndex.from_file()
+
+
+# ==========================================
+# スループット計測
+# ==========================================
+
+SAMPLE_OUTPUTS = [
+    "労働者派遣法（指揮命令の原則） / 労働基準法（労働時間管理）",
+    "下請法（第4条第1項第1号・第2号）",
+    "民法（第416条） / 民法第416条の2（不法行為に基づく損害賠償）",
+    "著作権法（第30条）",
+    "著作権法第三十条の四",
+    "個人情報の保護に関する法律 第27条第1項",
+    "個人情報保護法第２７条第７項",
+    "資金決済法",
+    "風営法第2条",
+    "個人情報保護法第27条, 労働基準法第32条",
+    "資金決済法、銀行法",
+]
+
+
+def _synthetic_outputs(n, seed=0):
+    """ベンチマーク用に様々な書式の引用文字列を生成"""
+    import random
+
+    rng = random.Random(seed)
+    laws = ["民法", "著作権法", "個人情報保護法", "下請法", "特商法", "労働基準法", "景品表示法", "風営法"]
+    outputs = []
+    for _ in range(n):
+        law = rng.choice(laws)
+        article = rng.randint(1, 1200)
+        text = f"{law}第{article}条"
+        if rng.random() < 0.3:
+            text += f"の{rng.randint(2, 9)}"
+        if rng.random() < 0.5:
+            text += f"第{rng.randint(1, 8)}項"
+        if rng.random() < 0.3:
+            text += f"第{rng.randint(1, 5)}号"
+        outputs.append(text)
+    return outputs
+
+
+def benchmark(n=200_000, unique=20_000):
+    """
+    大量のモデル出力に対する検証スループットを計測
+
+    Returns:
+        dict: キャッシュなし・ありそれぞれの 1引用あたり処理時間 (µs) と判定結果の内訳
+    """
+    index = CitationIndex.from_file(cache_size=0)
+    cached = CitationIndex.from_file(cache_size=unique)
+    pool = _synthetic_outputs(unique)
+    outputs = [pool[i % unique] for i in range(n)]
+
+    result = {}
+    for label, idx in (("uncached", index), ("cached", cached)):
+        start = time.perf_counter()
+        citations = idx.check_all(outputs)
+        elapsed = time.perf_counter() - start
+        result[label] = {"us_per_citation": elapsed / len(citations) * 1e6,
+                         "citations_per_sec": len(citations) / elapsed}
+    statuses = {}
+    for c in citations:
+        statuses[c.status] = statuses.get(c.status, 0) + 1
+    result["statuses"] = statuses
+    return result
+
+
+if __name__ == "__main__":
+    index = load_default_index()
+    for output in SAMPLE_OUTPUTS:
+        for c in index.check_all(output):
+            mark = "✅" if c.valid else "⚠️"
+            print(f"{mark} {c.raw:<36} -> {c.canonical} [{c.status}]")
+
+    r = benchmark()
+    print(f"\nuncached: {r['uncached']['us_per_citation']:.2f} µs/citation "
+          f"({r['uncached']['citations_per_sec']:,.0f} /s)")
+    print(f"cached:   {r['cached']['us_per_citation']:.2f} µs/citation "
+          f"({r['cached']['citations_per_sec']:,.0f} /s)")
+    print(f"statuses: {r['statuses']}")
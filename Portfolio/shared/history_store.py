@@ -0,0 +1,414 @@
+"""
+診断履歴の列指向ストア
+セッションごとの履歴（input / result / summary / timestamp）を、日付でパーティション分割した
+Parquet ファイルに追記し、法令別リスク分布・推奨事項の頻度・レイテンシ推移を集計する。
+
+    - 法令名・リスクレベルなどの低カーディナリティ列は辞書エンコード
+    - 追記はメモリ上にバッファし、一定件数ごと・一定時間ごと（バックグラウンドスレッド）に1ファイルとして書き出す
+    - 細かいファイルは compact() で1パーティション1ファイルにまとめる
+    - 集計はメモリマップで必要な列だけをバッチ単位で読み、Arrow 上で集計する
+      （行を Python オブジェクトに変換しない）
+
+使い方:
+    python history_store.py bench --rows 1000000    # 100万行での集計ベンチマーク
+    python history_store.py query --root history/   # 集計結果を表示
+"""
+
+import argparse
+import atexit
+import glob
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from citation_index import PLACEHOLDERS, load_default_index
+
+_DICT = pa.dictionary(pa.int16(), pa.string())
+
+SCHEMA = pa.schema([
+    ("assessment_id", pa.string()),
+    ("timestamp", pa.timestamp("ms")),
+    ("app", _DICT),
+    ("model", _DICT),
+    ("risk_level", _DICT),
+    ("laws", pa.list_(_DICT)),
+    ("summary", pa.string()),
+    ("input", pa.string()),
+    ("recommendations", pa.list_(pa.string())),
+    ("latency_ms", pa.float32()),
+])
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+DICTIONARY_COLUMNS = ["app", "model", "risk_level", "laws.list.element"]
+
+
+def normalize_laws(laws):
+    """集計用に法令名を正規化（条番号は除き、法令データにないものはそのまま）"""
+    if isinstance(laws, str):
+        laws = [laws]
+    names = []
+    for law in laws or []:
+        if law in PLACEHOLDERS:
+            continue
+        for citation in load_default_index().check_all(law):
+            name = citation.law or citation.raw
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def history_to_record(item, app, model=None):
+    """
+    セッションの履歴アイテムを保存用の1行に変換
+
+    Args:
+        item: {"input", "result", "summary", "latency_ms"}（任意で "id", "created_at", "model"）
+        app: アプリ名（"gemini" / "local"）
+        model: 使用したモデル名・アダプタ名（item に "model" がない場合に使用）
+    """
+    result = item.get("result") or {}
+    recs = result.get("recommendations", [])
+    return {
+        "assessment_id": item.get("id") or uuid.uuid4().hex,
+        "timestamp": item.get("created_at") or datetime.now(),
+        "app": app,
+        "model": item.get("model") or model,
+        "risk_level": result.get("risk_level"),
+        "laws": normalize_laws(result.get("laws", [])),
+        "summary": item.get("summary"),
+        "input": item.get("input"),
+        "recommendations": [r for r in ([recs] if isinstance(recs, str) else recs) if r not in PLACEHOLDERS],
+        "latency_ms": item.get("latency_ms"),
+    }
+
+
+class HistoryStore:
+    """
+    診断履歴を日付パーティションの Parquet に追記・集計するストア
+
+    Args:
+        root: 保存先ディレクトリ（root/date=YYYY-MM-DD/part-*.parquet）
+        flush_rows: この件数に達したらファイルに書き出す
+        flush_interval: この秒数ごとにバックグラウンドスレッドで書き出す（None の場合は件数と終了時のみ）
+            追記が途切れてもバッファが残り続けないため、atexit が走らない終了（SIGTERM 等）でも
+            失われるのは直近 flush_interval 秒分に限られる。細かいファイルは compact() でまとめる
+    """
+
+    def __init__(self, root, flush_rows=1000, flush_interval=5.0):
+        self.root = root
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        # 読み込みはメモリマップ（ページキャッシュから直接参照し、読み込み用のコピーを作らない）
+        self._fs = pafs.LocalFileSystem(use_mmap=True)
+        os.makedirs(root, exist_ok=True)
+        if flush_interval:
+            threading.Thread(target=self._flush_loop, name="history-flush", daemon=True).start()
+        atexit.register(self.close)
+
+    # ------------------------------------------
+    # 書き込み
+    # ------------------------------------------
+
+    def append(self, record):
+        """1件追記（history_to_record() の形式）"""
+        with self._lock:
+            self._buffer.append(record)
+            due = len(self._buffer) >= self.flush_rows
+        if due:
+            self.flush()
+
+    def flush(self):
+        """バッファの内容をパーティションごとに新しいファイルとして書き出す"""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if rows:
+            try:
+                self.write_table(pa.Table.from_pylist(rows, schema=SCHEMA))
+            except Exception:
+                # 書き出せなかった分はバッファに戻し、次回の書き出しで再試行する
+                with self._lock:
+                    self._buffer[:0] = rows
+                raise
+        return len(rows)
+
+    def close(self):
+        """定期書き出しを止め、残りのバッファを書き出す"""
+        self._closed.set()
+        return self.flush()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ 履歴の書き出しに失敗しました: {e}")
+
+    def write_table(self, table):
+        """Arrow テーブルを日付パーティションに分けて書き出す（一括エクスポート用）"""
+        table = table.cast(SCHEMA)
+        dates = pc.strftime(table["timestamp"], format="%Y-%m-%d")
+        for date in pc.unique(dates).to_pylist():
+            part = table.filter(pc.equal(dates, date))
+            directory = os.path.join(self.root, f"date={date}")
+            os.makedirs(directory, exist_ok=True)
+            pq.write_table(part, os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet"),
+                           use_dictionary=DICTIONARY_COLUMNS, compression="zstd")
+
+    def export_history(self, history, app, model=None):
+        """セッションの履歴リストをまとめて書き出す"""
+        rows = [history_to_record(item, app, model) for item in history]
+        if rows:
+            self.write_table(pa.Table.from_pylist(rows, schema=SCHEMA))
+        return len(rows)
+
+    def compact(self, date=None):
+        """
+        パーティション内の複数ファイルを1ファイルにまとめる
+
+        Args:
+            date: 対象日（"YYYY-MM-DD"）。None の場合は全パーティション
+
+        Returns:
+            int: まとめたファイル数
+        """
+        pattern = f"date={date}" if date else "date=*"
+        merged = 0
+        for directory in sorted(glob.glob(os.path.join(self.root, pattern))):
+            files = sorted(glob.glob(os.path.join(directory, "part-*.parquet")))
+            if len(files) < 2:
+                continue
+            table = pa.concat_tables(
+                pq.read_table(f, schema=SCHEMA, memory_map=True) for f in files
+            ).sort_by("timestamp")
+            tmp = os.path.join(directory, f".compact-{uuid.uuid4().hex}.tmp")
+            pq.write_table(table, tmp, use_dictionary=DICTIONARY_COLUMNS, compression="zstd",
+                           row_group_size=128 * 1024)
+            os.replace(tmp, os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet"))
+            for f in files:
+                os.remove(f)
+            merged += len(files)
+        return merged
+
+    # ------------------------------------------
+    # 集計（Arrow 上でバッチ単位に処理）
+    # ------------------------------------------
+
+    def dataset(self):
+        return ds.dataset(self.root, schema=SCHEMA.append(pa.field("date", pa.string())),
+                          format="parquet", partitioning=PARTITIONING, filesystem=self._fs)
+
+    def _scan(self, columns, start=None, end=None):
+        """必要な列だけをバッチ単位で読み出す（start / end は "YYYY-MM-DD"、パーティション単位で絞り込み）"""
+        condition = None
+        if start:
+            condition = ds.field("date") >= start
+        if end:
+            upper = ds.field("date") <= end
+            condition = upper if condition is None else condition & upper
+        return self.dataset().to_batches(columns=columns, filter=condition, batch_size=256 * 1024)
+
+    @staticmethod
+    def _combine(partials, keys, sum_columns):
+        """バッチごとの部分集計を結合して再集計"""
+        if not partials:
+            return pa.table({k: pa.array([], pa.string()) for k in keys}
+                            | {c: pa.array([], pa.int64()) for c in sum_columns})
+        merged = pa.concat_tables(partials, promote_options="permissive")
+        result = merged.group_by(keys).aggregate([(c, "sum") for c in sum_columns])
+        return result.rename_columns(keys + sum_columns)
+
+    def risk_distribution_by_law(self, start=None, end=None):
+        """
+        法令ごとのリスクレベル件数
+
+        Returns:
+            pa.Table: law, risk_level, count
+        """
+        partials = []
+        for batch in self._scan(["laws", "risk_level"], start, end):
+            laws = batch.column("laws")
+            # 1行に複数の法令があるため、法令ごとに展開してリスクレベルを対応付ける
+            flat = pc.list_flatten(laws)
+            parents = pc.list_parent_indices(laws)
+            risk = pc.take(batch.column("risk_level"), parents)
+            table = pa.table({"law": flat.cast(pa.string()), "risk_level": risk.cast(pa.string())})
+            partials.append(table.group_by(["law", "risk_level"]).aggregate([("law", "count")])
+                            .rename_columns(["law", "risk_level", "count"]))
+        result = self._combine(partials, ["law", "risk_level"], ["count"])
+        return result.sort_by([("count", "descending")])
+
+    def recommendation_frequency(self, top=20, start=None, end=None):
+        """
+        推奨事項の出現頻度（上位 top 件）
+
+        Returns:
+            pa.Table: recommendation, count
+        """
+        partials = []
+        for batch in self._scan(["recommendations"], start, end):
+            counts = pc.value_counts(pc.list_flatten(batch.column("recommendations")))
+            partials.append(pa.table({"recommendation": counts.field("values"),
+                                      "count": counts.field("counts")}))
+        result = self._combine(partials, ["recommendation"], ["count"])
+        return result.sort_by([("count", "descending")]).slice(0, top)
+
+    def latency_trend(self, start=None, end=None):
+        """
+        日ごとのレイテンシ推移
+
+        Returns:
+            pa.Table: date, count, mean_ms, max_ms
+        """
+        partials = []
+        for batch in self._scan(["date", "latency_ms"], start, end):
+            table = pa.table({"date": batch.column("date"),
+                              "latency_ms": batch.column("latency_ms").cast(pa.float64())})
+            partials.append(table.group_by("date").aggregate([
+                ("latency_ms", "count"), ("latency_ms", "sum"), ("latency_ms", "max")]))
+        if not partials:
+            return pa.table({"date": [], "count": [], "mean_ms": [], "max_ms": []})
+        merged = pa.concat_tables(partials).group_by("date").aggregate([
+            ("latency_ms_count", "sum"), ("latency_ms_sum", "sum"), ("latency_ms_max", "max")])
+        count = merged["latency_ms_count_sum"]
+        return pa.table({
+            "date": merged["date"],
+            "count": count,
+            "mean_ms": pc.divide(merged["latency_ms_sum_sum"], count),
+            "max_ms": merged["latency_ms_max_max"],
+        }).sort_by("date")
+
+    def row_count(self):
+        return self.dataset().count_rows()
+
+
+def history_to_parquet_bytes(history, app, model=None):
+    """セッションの履歴を1つの Parquet ファイル（bytes）に変換（ダウンロード用）"""
+    table = pa.Table.from_pylist([history_to_record(item, app, model) for item in history], schema=SCHEMA)
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, use_dictionary=DICTIONARY_COLUMNS, compression="zstd")
+    return sink.getvalue().to_pybytes()
+
+
+# ==========================================
+# ベンチマーク
+# ==========================================
+
+def synthetic_table(rows, days=30, seed=0):
+    """ベンチマーク用の合成データ（Python の行オブジェクトを作らず numpy から直接生成）"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    laws = ["個人情報保護法", "下請法", "労働者派遣法", "景品表示法", "特定商取引法", "資金決済法",
+            "消費者契約法", "著作権法", "民法", "電気通信事業法"]
+    risks = ["High", "Medium", "Low"]
+    recs = [f"推奨事項{i}" for i in range(200)]
+
+    start = np.datetime64("2026-01-01T00:00:00", "ms")
+    timestamps = start + rng.integers(0, days * 86_400_000, rows).astype("timedelta64[ms]")
+    n_laws = rng.integers(1, 4, rows)
+    n_recs = rng.integers(1, 4, rows)
+    law_offsets = np.concatenate([[0], np.cumsum(n_laws)]).astype(np.int32)
+    rec_offsets = np.concatenate([[0], np.cumsum(n_recs)]).astype(np.int32)
+    law_values = pa.DictionaryArray.from_arrays(
+        pa.array(rng.integers(0, len(laws), law_offsets[-1]).astype(np.int16)), laws)
+    rec_values = pa.DictionaryArray.from_arrays(
+        pa.array(rng.zipf(1.5, rec_offsets[-1]).clip(1, len(recs)).astype(np.int16) - 1), recs)
+    inputs = pa.DictionaryArray.from_arrays(
+        pa.array(rng.integers(0, 1000, rows).astype(np.int16)), [f"仕様サンプル{i}" for i in range(1000)])
+
+    return pa.table({
+        "assessment_id": pa.array(np.char.mod("%032x", np.arange(rows))),
+        "timestamp": pa.array(timestamps),
+        "app": pa.DictionaryArray.from_arrays(pa.array(rng.integers(0, 2, rows).astype(np.int16)),
+                                              ["gemini", "local"]),
+        "model": pa.DictionaryArray.from_arrays(pa.array(np.zeros(rows, np.int16)), ["gemini-2.5-flash"]),
+        "risk_level": pa.DictionaryArray.from_arrays(
+            pa.array(rng.choice(3, rows, p=[0.3, 0.5, 0.2]).astype(np.int16)), risks),
+        "laws": pa.ListArray.from_arrays(pa.array(law_offsets), law_values),
+        "summary": pa.array(np.full(rows, "サマリー")),
+        "input": inputs.cast(pa.string()),
+        "recommendations": pa.ListArray.from_arrays(pa.array(rec_offsets), rec_values.cast(pa.string())),
+        "latency_ms": pa.array(rng.lognormal(7, 0.4, rows).astype(np.float32)),
+    })
+
+
+def benchmark(root, rows=1_000_000, files_per_day=4):
+    """rows 行を書き込み、各集計クエリの処理時間を計測"""
+    import resource
+
+    store = HistoryStore(root)
+    table = synthetic_table(rows)
+    start = time.perf_counter()
+    for chunk in range(files_per_day):
+        store.write_table(table.slice(chunk * rows // files_per_day, rows // files_per_day))
+    write_s = time.perf_counter() - start
+    del table
+
+    start = time.perf_counter()
+    merged = store.compact()
+    compact_s = time.perf_counter() - start
+    size_mb = sum(os.path.getsize(f) for f in glob.glob(os.path.join(root, "*", "*.parquet"))) / 2**20
+
+    timings = {}
+    for name, query in [
+        ("risk_distribution_by_law", store.risk_distribution_by_law),
+        ("recommendation_frequency", store.recommendation_frequency),
+        ("latency_trend", store.latency_trend),
+        ("latency_trend (7 days)", lambda: store.latency_trend(start="2026-01-01", end="2026-01-07")),
+    ]:
+        start = time.perf_counter()
+        result = query()
+        timings[name] = (time.perf_counter() - start, result.num_rows)
+
+    print(f"rows: {store.row_count():,}  size: {size_mb:.1f} MB  "
+          f"write: {write_s:.2f} s  compact: {compact_s:.2f} s ({merged} files)")
+    for name, (seconds, n) in timings.items():
+        print(f"  {name:<28} {seconds * 1000:>8.1f} ms  ({n} rows)")
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="診断履歴の列指向ストア")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="合成データで集計クエリを計測")
+    bench.add_argument("--rows", type=int, default=1_000_000)
+    bench.add_argument("--root", default=None, help="書き込み先（省略時は一時ディレクトリ）")
+    query = sub.add_parser("query", help="集計結果を表示")
+    query.add_argument("--root", default=os.environ.get("GUARDIAN_HISTORY_DIR", "history"))
+    query.add_argument("--start", default=None)
+    query.add_argument("--end", default=None)
+    query.add_argument("--compact", action="store_true", help="集計前にファイルをまとめる")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        if args.root:
+            benchmark(args.root, args.rows)
+        else:
+            import tempfile
+            with tempfile.TemporaryDirectory() as root:
+                benchmark(root, args.rows)
+        return
+
+    store = HistoryStore(args.root)
+    if args.compact:
+        print(f"🗜️ {store.compact()} ファイルをまとめました")
+    print("📊 法令別リスク分布")
+    print(store.risk_distribution_by_law(args.start, args.end).to_pandas().to_string(index=False))
+    print("\n💡 推奨事項の頻度")
+    print(store.recommendation_frequency(start=args.start, end=args.end).to_pandas().to_string(index=False))
+    print("\n⏱️ レイテンシ推移")
+    print(store.latency_trend(args.start, args.end).to_pandas().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
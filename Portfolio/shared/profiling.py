@@ -0,0 +1,339 @@
+"""
+パイプライン・プロファイリングモジュール
+リクエスト単位で各ステージ（プロンプト構築・推論・デコード・JSONパース・描画など）の処理時間を計測し、
+フレームグラフ用の collapsed stack ファイルとステージ別サマリーを出力する。
+無効時は stage() がコンテキスト変数の参照1回のみで戻るため、オーバーヘッドはほぼゼロ。
+計測中のリクエストは contextvars で保持するため、copy_context() で別スレッドに引き継げる。
+sampling / cprofile はスレッド単位のため、引き継いだ先のスレッドでは attach_thread() で計測対象に追加する。
+
+設定（環境変数）:
+    GUARDIAN_PROFILE          off（既定） / on（全リクエスト） / sample（確率でサンプリング）
+    GUARDIAN_PROFILE_RATE     sample 時の計測確率（例: 0.05）
+    GUARDIAN_PROFILE_TOOLS    timer に加えて使うツール（sampling, cprofile, torch をカンマ区切り）
+    GUARDIAN_PROFILE_DIR      出力先ディレクトリ（既定: profiles）
+    GUARDIAN_PROFILE_INTERVAL_MS  sampling のサンプリング間隔
+
+使い方:
+    with profiler.request("assessment", force=...):
+        with stage("generate"):
+            ...
+    python profiling.py profiles/     # ステージ別サマリーを表示
+"""
+
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+_current = contextvars.ContextVar("guardian_profile", default=None)
+
+
+class _NullContext:
+    """無効時に返す何もしないコンテキスト"""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullContext()
+
+
+class _Stage:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.stage_stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        path = ";".join(self.profile.stage_stack)
+        self.profile.stages[path] = self.profile.stages.get(path, 0.0) + elapsed
+        self.profile.stage_stack.pop()
+        return False
+
+
+def stage(name):
+    """
+    現在のコンテキストで計測中のリクエストがあればステージとして計測する
+
+    Args:
+        name: ステージ名（ネストした場合は "親;子" として記録）
+    """
+    profile = _current.get()
+    if profile is None:
+        return _NULL
+    return _Stage(profile, name)
+
+
+class _StackSampler(threading.Thread):
+    """対象スレッドのコールスタックを一定間隔で採取する（sampling プロファイラ）"""
+
+    def __init__(self, profile, thread_id, interval):
+        super().__init__(daemon=True)
+        self.profile = profile
+        self.thread_ids = {thread_id}
+        self.interval = interval
+        self.counts = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            current = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = current.get(thread_id)
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if frames:
+                    key = [self.profile.kind] + list(self.profile.stage_stack) + frames[::-1]
+                    self.counts[";".join(key)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfile:
+    """1リクエスト分の計測結果"""
+
+    def __init__(self, profiler, kind, request_id=None):
+        self.profiler = profiler
+        self.kind = kind
+        self.request_id = request_id or uuid.uuid4().hex[:8]
+        self.stages = {}
+        self.stage_stack = []
+        self._sampler = None
+        self._cprofile = None
+        self._thread_cprofiles = []  # attach_thread() したスレッドの cProfile
+        self._torch = None
+        self.skipped = {}  # 使えなかったツールとその理由（サマリーに記録）
+
+    def __enter__(self):
+        tools = self.profiler.tools
+        if "sampling" in tools:
+            self._sampler = _StackSampler(self, threading.get_ident(), self.profiler.interval)
+            self._sampler.start()
+        if "cprofile" in tools:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            try:
+                self._cprofile.enable()
+            except ValueError as e:
+                # Python 3.12 以降は同時に有効にできる cProfile が1つだけのため、
+                # 別のセッションが計測中の場合はこのリクエストの cProfile を省略する
+                self._cprofile = None
+                self.skipped["cprofile"] = f"別のリクエストが cProfile で計測中 ({e})"
+        if "torch" in tools:
+            import torch
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            # verbose=True でないと export_stacks にスタックが出力されない
+            self._torch = torch.profiler.profile(
+                activities=activities,
+                with_stack=True,
+                experimental_config=torch._C._profiler._ExperimentalConfig(verbose=True),
+            )
+            self._torch.__enter__()
+        self.start = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.total = time.perf_counter() - self.start
+        _current.reset(self._token)
+        if self._torch is not None:
+            self._torch.__exit__(None, None, None)
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        self.profiler.write(self)
+        return False
+
+
+class _ThreadAttachment:
+    """現在のスレッドを計測中のリクエストの sampling / cprofile 対象に加える"""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self._thread_id = None
+        self._cprofile = None
+
+    def __enter__(self):
+        profile = self.profile
+        if profile._sampler is not None:
+            self._thread_id = threading.get_ident()
+            profile._sampler.thread_ids.add(self._thread_id)
+        if profile._cprofile is not None:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            try:
+                self._cprofile.enable()
+            except ValueError:
+                # Python 3.12 以降の cProfile は全スレッドを対象にするため、追加の計測は不要
+                self._cprofile = None
+        return self
+
+    def __exit__(self, *exc):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self.profile._thread_cprofiles.append(self._cprofile)
+        if self._thread_id is not None:
+            self.profile._sampler.thread_ids.discard(self._thread_id)
+        return False
+
+
+def attach_thread():
+    """
+    copy_context() で引き継いだ別スレッドの処理を、sampling / cprofile の計測対象に加える
+    （計測中のリクエストがなければ何もしない）
+
+    使い方:
+        ctx.run(lambda: ...)  の中で  with attach_thread(): handler()
+    """
+    profile = _current.get()
+    if profile is None:
+        return _NULL
+    return _ThreadAttachment(profile)
+
+
+class Profiler:
+    """
+    プロファイリングの有効化を判定し、結果をファイルに書き出すクラス
+
+    Args:
+        mode: "off" / "on" / "sample"
+        rate: sample 時の計測確率
+        tools: timer 以外に使うツール（"sampling", "cprofile", "torch"）
+        output_dir: 出力先ディレクトリ
+        interval_ms: sampling のサンプリング間隔
+    """
+
+    def __init__(self, mode="off", rate=0.0, tools=(), output_dir="profiles", interval_ms=5.0):
+        self.mode = mode
+        self.rate = rate
+        self.tools = set(tools)
+        self.output_dir = output_dir
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        tools = os.environ.get("GUARDIAN_PROFILE_TOOLS", "")
+        return cls(
+            mode=os.environ.get("GUARDIAN_PROFILE", "off"),
+            rate=float(os.environ.get("GUARDIAN_PROFILE_RATE", "0")),
+            tools=[t.strip() for t in tools.split(",") if t.strip()],
+            output_dir=os.environ.get("GUARDIAN_PROFILE_DIR", "profiles"),
+            interval_ms=float(os.environ.get("GUARDIAN_PROFILE_INTERVAL_MS", "5")),
+        )
+
+    def should_profile(self, force=False):
+        if force or self.mode == "on":
+            return True
+        return self.mode == "sample" and random.random() < self.rate
+
+    def request(self, kind, force=False, request_id=None):
+        """
+        リクエストの計測を開始するコンテキストを返す（対象外なら何もしない）
+
+        Args:
+            kind: リクエスト種別（"assessment", "render" など）
+            force: True の場合、設定に関わらず計測する（?profile=1 など）
+        """
+        if not self.should_profile(force):
+            return _NULL
+        return RequestProfile(self, kind, request_id)
+
+    def write(self, profile):
+        """ステージ別 collapsed stack・各ツールの結果・サマリーを書き出す"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.output_dir, f"{stamp}_{profile.kind}_{profile.request_id}")
+
+        # ステージ単位のフレームグラフ（重みはマイクロ秒、子ステージの時間は親から差し引く）
+        self_time = dict(profile.stages)
+        for path, seconds in profile.stages.items():
+            parent = path.rsplit(";", 1)[0] if ";" in path else None
+            if parent in self_time:
+                self_time[parent] -= seconds
+        other = profile.total - sum(s for p, s in profile.stages.items() if ";" not in p)
+        self_time["(other)"] = max(0.0, other)
+        with open(f"{base}.stages.folded", "w", encoding="utf-8") as f:
+            for path, seconds in self_time.items():
+                f.write(f"{profile.kind};{path} {max(0, int(seconds * 1e6))}\n")
+
+        if profile._sampler is not None:
+            with open(f"{base}.sample.folded", "w", encoding="utf-8") as f:
+                for stack, count in profile._sampler.counts.items():
+                    f.write(f"{stack} {count}\n")
+        if profile._cprofile is not None:
+            import pstats
+            stats = pstats.Stats(profile._cprofile)
+            for thread_profile in profile._thread_cprofiles:
+                stats.add(thread_profile)
+            stats.dump_stats(f"{base}.prof")
+        if profile._torch is not None:
+            profile._torch.export_stacks(f"{base}.torch.folded", "self_cpu_time_total")
+
+        record = {
+            "request_id": profile.request_id,
+            "kind": profile.kind,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "total_ms": round(profile.total * 1000, 3),
+            "stages_ms": {k: round(v * 1000, 3) for k, v in profile.stages.items()},
+        }
+        if profile.skipped:
+            record["skipped"] = profile.skipped
+        with self._lock, open(os.path.join(self.output_dir, "summary.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def summarize(output_dir="profiles"):
+    """
+    summary.jsonl からステージ別の処理時間を集計
+
+    Returns:
+        dict: {(kind, stage): {"count", "mean_ms", "p50_ms", "p95_ms"}}
+    """
+    samples = {}
+    with open(os.path.join(output_dir, "summary.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            samples.setdefault((record["kind"], "(total)"), []).append(record["total_ms"])
+            for name, ms in record["stages_ms"].items():
+                samples.setdefault((record["kind"], name), []).append(ms)
+
+    result = {}
+    for key, values in samples.items():
+        values.sort()
+        result[key] = {
+            "count": len(values),
+            "mean_ms": sum(values) / len(values),
+            "p50_ms": values[len(values) // 2],
+            "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))],
+        }
+    return result
+
+
+if __name__ == "__main__":
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else "profiles"
+    print(f"{'kind':<12} {'stage':<28} {'count':>6} {'mean(ms)':>10} {'p50(ms)':>10} {'p95(ms)':>10}")
+    for (kind, name), s in sorted(summarize(output_dir).items()):
+        print(f"{kind:<12} {name:<28} {s['count']:>6} {s['mean_ms']:>10.2f} {s['p50_ms']:>10.2f} {s['p95_ms']:>10.2f}")
@@ -0,0 +1,313 @@
+"""
+Self-consistency サンプリング（複数候補の多数決）
+同じ入力から k 件の候補を生成し、1つの診断結果にまとめる。境界的な仕様でリスクレベルが
+実行ごとに入れ替わる問題を、1回分の出力ではなく候補の多数派で判定することで抑える。
+
+    - risk_level: 多数決（同数の場合はより重いレベルを採用）
+    - laws / recommendations: 候補の min_support を超える割合（既定は過半数）に現れたものを頻度順に採用
+      （法令は法令インデックスで正規化してから集計するため、表記ゆれは同じ票になる）
+    - reason / summary: 多数派の候補のうち、採用した法令・推奨事項と最も重なる候補から取る
+    - consistency: 候補数・有効候補数・票の内訳・一致率（agreement）を付与
+
+候補の生成は呼び出し側で行う（ローカルモデルは num_return_sequences による1回のバッチ生成、
+Gemini は k 件の並行リクエスト）。
+
+設定（環境変数）:
+    GUARDIAN_SAMPLES             候補数 k（既定 1 = 無効）
+    GUARDIAN_SAMPLE_TEMPERATURE  候補生成時の temperature（既定 0.7）
+
+使い方（フェイクバックエンドでの安定性・レイテンシ計測）:
+    python self_consistency.py
+"""
+
+import itertools
+import os
+import re
+import time
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+from citation_index import PLACEHOLDERS, load_default_index, split_laws
+
+RISK_LEVELS = ("High", "Medium", "Low")  # 重い順（同数時はこの順で優先）
+DEFAULT_SAMPLES = int(os.environ.get("GUARDIAN_SAMPLES", "1"))
+DEFAULT_TEMPERATURE = float(os.environ.get("GUARDIAN_SAMPLE_TEMPERATURE", "0.7"))
+SAMPLE_OPTIONS = sorted({1, 3, 5, 7, DEFAULT_SAMPLES})  # 画面で選べる候補数
+
+
+# ==========================================
+# 正規化
+# ==========================================
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def law_keys(laws, index=None):
+    """
+    laws の各法令を集計用のキーに変換（括弧内の補足は除き、条・項・号まで正規化）
+
+    Returns:
+        list[tuple]: (キー, 元の表記) のリスト。プレースホルダは除外
+    """
+    index = index or load_default_index()
+    keys = []
+    for entry in _as_list(laws):
+        for part in split_laws(entry):
+            if part in PLACEHOLDERS:
+                continue
+            citations = index.check(part)
+            key = tuple(replace(c, note="").canonical if c.law else re.sub(r"\s+", "", c.raw) for c in citations)
+            keys.append((key, part))
+    return keys
+
+
+def recommendation_key(text):
+    """推奨事項の表記ゆれ（全角・空白・文末の句点）を除いた集計用キー"""
+    text = re.sub(r"\s+", "", unicodedata.normalize("NFKC", str(text)))
+    return text.rstrip("。.")
+
+
+def _jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _vote(items_per_candidate, min_support, limit):
+    """
+    候補ごとの [(キー, 表記), ...] から、支持率が min_support を超えるものを頻度順に選ぶ
+
+    Returns:
+        list[tuple]: (キー, 最初に現れた表記) のリスト（最大 limit 件）
+    """
+    counts, first_seen = Counter(), {}
+    for items in items_per_candidate:
+        for key, text in dict(items).items():  # 同じ候補内の重複は1票
+            counts[key] += 1
+            first_seen.setdefault(key, text)
+    needed = min_support * len(items_per_candidate)
+    order = {key: i for i, key in enumerate(first_seen)}
+    # 既定の 0.5 では過半数（4候補中2件のような同数は不採用）
+    chosen = sorted((k for k, c in counts.items() if c > needed), key=lambda k: (-counts[k], order[k]))
+    return [(key, first_seen[key]) for key in chosen[:limit]]
+
+
+# ==========================================
+# 集約
+# ==========================================
+
+def aggregate(candidates, min_support=0.5, index=None):
+    """
+    k 件の候補（パース済みの診断結果）を多数決で1つにまとめる
+
+    Args:
+        candidates: 診断結果 dict のリスト（パースに失敗した候補は None や risk_level="Check" のまま渡す）
+        min_support: laws / recommendations の採用に必要な支持率（有効候補に対する割合。この値を超えたものを採用）
+        index: 法令の正規化に使う CitationIndex（既定は statutes.json）
+
+    Returns:
+        dict: 集約後の診断結果。"consistency" に以下を含む
+            k: 候補数 / valid: 有効な候補数 / risk_votes: リスクレベルごとの票数
+            agreement: 採用したリスクレベルの票数 / k
+            law_agreement: 有効候補間の法令集合の平均 Jaccard 係数
+    """
+    k = len(candidates)
+    valid = [c for c in candidates if c and c.get("risk_level") in RISK_LEVELS]
+    if not valid:
+        # 全候補が不正な場合は先頭の候補をそのまま返す（"Check" 表示など既存の扱いに任せる）
+        fallback = dict(next((c for c in candidates if c), {}))
+        fallback["consistency"] = {"k": k, "valid": 0, "risk_votes": {}, "agreement": 0.0, "law_agreement": 0.0}
+        return fallback
+
+    votes = Counter(c["risk_level"] for c in valid)
+    risk = max(RISK_LEVELS, key=lambda level: (votes[level], -RISK_LEVELS.index(level)))
+    majority = [c for c in valid if c["risk_level"] == risk]
+
+    laws = [law_keys(c.get("laws"), index) for c in valid]
+    recs = [[(recommendation_key(r), r) for r in _as_list(c.get("recommendations"))] for c in valid]
+    # 推奨事項は候補の典型的な件数（中央値）を上限にする
+    rec_limit = max(1, sorted(len(r) for r in recs)[len(recs) // 2])
+    chosen_laws = _vote(laws, min_support, limit=None)
+    chosen_recs = _vote(recs, min_support, limit=rec_limit)
+
+    law_sets = [{key for key, _ in items} for items in laws]
+    chosen_law_keys = {key for key, _ in chosen_laws}
+    chosen_rec_keys = {key for key, _ in chosen_recs}
+
+    def overlap(i):
+        rec_set = {key for key, _ in recs[i]}
+        return _jaccard(law_sets[i], chosen_law_keys) + _jaccard(rec_set, chosen_rec_keys)
+
+    # 多数派の中で採用結果に最も近い候補を代表にする（理由・サマリーの整合性を保つため）
+    representative_index = max((i for i, c in enumerate(valid) if c["risk_level"] == risk),
+                               key=lambda i: (overlap(i), -i))
+    representative = valid[representative_index]
+
+    result = dict(representative)
+    result["risk_level"] = risk
+    # 支持率を満たすものがない場合は代表候補の内容を使う
+    result["laws"] = [text for _, text in chosen_laws] or _as_list(representative.get("laws"))
+    result["recommendations"] = [text for _, text in chosen_recs] or _as_list(representative.get("recommendations"))
+
+    pairs = list(itertools.combinations(law_sets, 2))
+    result["consistency"] = {
+        "k": k,
+        "valid": len(valid),
+        "risk_votes": {level: votes[level] for level in RISK_LEVELS if votes[level]},
+        "agreement": round(len(majority) / k, 3),
+        "law_agreement": round(sum(_jaccard(a, b) for a, b in pairs) / len(pairs), 3) if pairs else 1.0,
+    }
+    return result
+
+
+def sample_parallel(call, k, max_workers=None):
+    """
+    call() を k 回並行に実行（Gemini など I/O 待ちが中心の同期 API 向け）
+
+    Returns:
+        tuple: (成功した結果のリスト, 発生した例外のリスト)
+    """
+    if k <= 1:
+        return [call()], []
+    results, errors = [], []
+    with ThreadPoolExecutor(max_workers=max_workers or k) as pool:
+        futures = [pool.submit(call) for _ in range(k)]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(e)
+    return results, errors
+
+
+def consistency_caption(result):
+    """集約結果の一致率を表示用の1行にまとめる（k=1 の場合は None）"""
+    info = result.get("consistency") if result else None
+    if not info or info["k"] <= 1:
+        return None
+    if not info["valid"]:
+        return f"⚠️ {info['k']}候補のいずれからも診断結果を読み取れませんでした"
+    votes = info["risk_votes"].get(result.get("risk_level"), 0)
+    return (f"🗳️ {info['k']}候補中{votes}件が {result.get('risk_level')} "
+            f"(一致率 {info['agreement']:.0%} / 法令の一致 {info['law_agreement']:.0%})")
+
+
+# ==========================================
+# ベンチマーク（フェイクバックエンド）
+# ==========================================
+
+class FakeSampler:
+    """
+    境界的な仕様に対するモデル出力を模倣するフェイクバックエンド
+
+    リスクレベル・法令・推奨事項を確率的に出力し、レイテンシは
+    「固定オーバーヘッド + 出力トークン数 × デコード時間」で再現する。
+    バッチ生成（num_return_sequences）では k 本の系列を1回のデコードで進めるため、
+    追加の系列ごとに batch_cost（1系列分に対する割合）だけ時間が増える。
+    """
+
+    def __init__(self, risk_probs=None, law_probs=None, rec_probs=None, overhead_ms=30.0,
+                 output_tokens=120, ms_per_token=0.5, batch_cost=0.1, seed=0):
+        import random
+
+        self.risk_probs = risk_probs or {"High": 0.65, "Medium": 0.3, "Low": 0.05}
+        self.law_probs = law_probs or {
+            "資金決済法第37条": 0.9, "資金決済法（資金移動業の登録）": 0.3,
+            "銀行法": 0.35, "犯罪収益移転防止法": 0.2, "景品表示法": 0.1,
+        }
+        self.rec_probs = rec_probs or {
+            "資金移動業の登録を検討する": 0.85, "資金移動業の登録を検討する。": 0.1,
+            "ポイントの換金性を排除する": 0.7, "専門家に相談する": 0.6, "利用規約を改定する": 0.2,
+        }
+        self.overhead_ms = overhead_ms
+        self.decode_ms = output_tokens * ms_per_token
+        self.batch_cost = batch_cost
+        self._rng = random.Random(seed)
+
+    def _sample_one(self):
+        rng = self._rng
+        levels, weights = zip(*self.risk_probs.items())
+        return {
+            "risk_level": rng.choices(levels, weights)[0],
+            "summary": "ポイント換金機能",
+            "laws": [law for law, p in self.law_probs.items() if rng.random() < p] or ["-"],
+            "reason": "ポイントの現金化は資金移動に該当する可能性があります。",
+            "recommendations": [rec for rec, p in self.rec_probs.items() if rng.random() < p],
+        }
+
+    def call(self):
+        """1候補分の API 呼び出し（並行実行される前提で sleep により待ち時間を再現）"""
+        time.sleep((self.overhead_ms + self.decode_ms) / 1000)
+        return self._sample_one()
+
+    def batch(self, k):
+        """num_return_sequences=k の1回のバッチ生成"""
+        time.sleep((self.overhead_ms + self.decode_ms * (1 + self.batch_cost * (k - 1))) / 1000)
+        return [self._sample_one() for _ in range(k)]
+
+
+def stability(k, trials=400, seed=0):
+    """
+    同じ入力を2回診断したときに結果が食い違う割合を計測
+
+    Returns:
+        dict: risk_flip_rate（リスクレベルが入れ替わった割合）と law_jaccard（2回の法令集合の平均一致度）
+    """
+    sampler = FakeSampler(seed=seed)
+    flips, jaccards = 0, []
+    for _ in range(trials):
+        a, b = (aggregate([sampler._sample_one() for _ in range(k)]) for _ in range(2))
+        flips += a["risk_level"] != b["risk_level"]
+        keys = [{key for key, _ in law_keys(r["laws"])} for r in (a, b)]
+        jaccards.append(_jaccard(*keys))
+    return {"k": k, "risk_flip_rate": flips / trials, "law_jaccard": sum(jaccards) / len(jaccards)}
+
+
+def latency(k, runs=5, **sampler_kwargs):
+    """
+    k 候補を得るまでの待ち時間 (ms, runs 回の中央値) を生成方式ごとに比較
+
+    Returns:
+        dict: sequential（逐次 k 回）/ parallel（並行 k 件）/ batched（1回のバッチ生成）/ aggregate_us（集約処理）
+    """
+    sampler = FakeSampler(**sampler_kwargs)
+    modes = {
+        "sequential": lambda: [sampler.call() for _ in range(k)],
+        "parallel": lambda: sample_parallel(sampler.call, k)[0],
+        "batched": lambda: sampler.batch(k),
+    }
+    result = {"k": k}
+    for name, run in modes.items():
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            candidates = run()
+            times.append((time.perf_counter() - start) * 1000)
+        result[name] = sorted(times)[len(times) // 2]
+    start = time.perf_counter()
+    for _ in range(100):
+        aggregate(candidates)
+    result["aggregate_us"] = (time.perf_counter() - start) / 100 * 1e6
+    return result
+
+
+if __name__ == "__main__":
+    print("安定性（同じ入力を2回診断したときの食い違い, フェイクバックエンド）")
+    print(f"{'k':>3} {'risk flip':>10} {'law jaccard':>12}")
+    rows = [stability(k) for k in (1, 3, 5, 7)]
+    for r in rows:
+        print(f"{r['k']:>3} {r['risk_flip_rate']:>10.1%} {r['law_jaccard']:>12.2f}")
+    assert rows[2]["risk_flip_rate"] < rows[0]["risk_flip_rate"], "k=5 で食い違いが減っていません"
+
+    print("\nレイテンシ（k 候補を得るまでの待ち時間 ms, フェイクバックエンド）")
+    print(f"{'k':>3} {'sequential':>11} {'parallel':>9} {'batched':>8} {'aggregate(µs)':>14}")
+    for k in (1, 3, 5, 7):
+        r = latency(k)
+        print(f"{k:>3} {r['sequential']:>11.1f} {r['parallel']:>9.1f} {r['batched']:>8.1f} {r['aggregate_us']:>14.0f}")
+
+    print("✅ 候補の多数決でリスクレベルの食い違いが減少")
@@ -0,0 +1,74 @@
+"""citation_index のテスト"""
+
+from citation_index import load_default_index, split_laws, to_int
+
+
+def check(text):
+    return [(c.canonical, c.status) for c in load_default_index().check_all(text)]
+
+
+# ==========================================
+# 複数の法令を含む文字列
+# ==========================================
+
+def test_each_law_keeps_its_own_articles():
+    assert check("個人情報保護法第27条, 労働基準法第32条") == [
+        ("個人情報保護法第27条", "ok"), ("労働基準法第32条", "ok")]
+
+
+def test_unknown_law_after_a_known_one_is_checked():
+    assert check("資金決済法、銀行法") == [("資金決済法", "ok"), ("銀行法", "unknown_law")]
+
+
+def test_laws_without_separator_are_split():
+    citations = load_default_index().check_all("個人情報保護法第27条労働基準法第32条")
+    assert [(c.law, c.article) for c in citations] == [("個人情報保護法", 27), ("労働基準法", 32)]
+
+
+def test_comma_inside_article_list_or_brackets_is_not_a_law_separator():
+    assert split_laws("下請法第4条第1項第1号、第2号") == ["下請法第4条第1項第1号、第2号"]
+    assert split_laws("労働基準法（労働時間管理、休憩）") == ["労働基準法（労働時間管理、休憩）"]
+    assert split_laws("民法 / 下請法、著作権法") == ["民法", "下請法", "著作権法"]
+    assert check("下請法（第4条第1項第1号、第2号）") == [("下請法第4条第1項第1号・第2号", "ok")]
+
+
+# ==========================================
+# 正規化
+# ==========================================
+
+def test_aliases_and_formal_names_are_normalized():
+    assert check("個情法第27条") == [("個人情報保護法第27条", "ok")]
+    assert check("個人情報の保護に関する法律 第27条第1項") == [("個人情報保護法第27条第1項", "ok")]
+
+
+def test_kanji_and_fullwidth_numerals():
+    assert to_int("四百十六") == 416
+    assert to_int("三十") == 30
+    assert check("著作権法第三十条の四") == [("著作権法第30条の4", "ok")]
+    assert check("個人情報保護法第２７条第１項") == [("個人情報保護法第27条第1項", "ok")]
+
+
+def test_note_is_kept():
+    assert check("労働者派遣法（指揮命令の原則）") == [("労働者派遣法（指揮命令の原則）", "ok")]
+
+
+# ==========================================
+# 存在しない条・項・号
+# ==========================================
+
+def test_unknown_article():
+    assert check("個人情報保護法第186条") == [("個人情報保護法第186条", "unknown_article")]
+    assert check("民法第416条の2") == [("民法第416条の2", "unknown_article")]
+
+
+def test_unknown_paragraph():
+    assert check("個人情報保護法第27条第7項") == [("個人情報保護法第27条第7項", "unknown_paragraph")]
+
+
+def test_unknown_item():
+    assert check("著作権法第30条の4第1項第3号") == [("著作権法第30条の4第1項第3号", "ok")]
+    assert check("著作権法第30条の4第1項第4号") == [("著作権法第30条の4第1項第4号", "unknown_item")]
+
+
+def test_unknown_law():
+    assert check("銀行法第1条") == [("銀行法第1条", "unknown_law")]
@@ -0,0 +1,52 @@
+"""history_store のテスト"""
+
+import io
+import time
+from datetime import datetime
+
+import pyarrow.parquet as pq
+
+from history_store import HistoryStore, history_to_parquet_bytes, history_to_record, normalize_laws
+
+ITEM = {
+    "id": "a" * 32,
+    "created_at": datetime(2026, 1, 2, 10, 30),
+    "input": "会員の購買履歴を提携先に提供する",
+    "result": {"risk_level": "High", "laws": ["個人情報保護法"], "recommendations": ["同意を取得する"]},
+    "summary": "第三者提供",
+    "latency_ms": 120.0,
+}
+
+
+def test_record_keeps_item_id_and_creation_time():
+    record = history_to_record(ITEM, "gemini", "gemini-2.5-flash")
+    assert record["assessment_id"] == ITEM["id"]
+    assert record["timestamp"] == ITEM["created_at"]
+
+    table = pq.read_table(io.BytesIO(history_to_parquet_bytes([ITEM], "gemini")))
+    assert table["assessment_id"].to_pylist() == [ITEM["id"]]
+    assert table["timestamp"].to_pylist() == [ITEM["created_at"]]
+
+
+def test_pending_rows_are_flushed_without_further_appends(tmp_path):
+    store = HistoryStore(str(tmp_path), flush_interval=0.05)
+    try:
+        store.append(history_to_record(ITEM, "gemini"))
+        deadline = time.monotonic() + 5
+        while not list(tmp_path.glob("date=2026-01-02/*.parquet")) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.row_count() == 1
+    finally:
+        store.close()
+
+
+def test_close_flushes_buffer(tmp_path):
+    store = HistoryStore(str(tmp_path), flush_interval=None)
+    store.append(history_to_record(ITEM, "gemini"))
+    assert store.close() == 1
+    assert store.row_count() == 1
+
+
+def test_normalize_laws_keeps_every_law():
+    assert normalize_laws("個人情報保護法第27条, 労働基準法第32条") == ["個人情報保護法", "労働基準法"]
+    assert normalize_laws(["資金決済法、銀行法"]) == ["資金決済法", "銀行法"]
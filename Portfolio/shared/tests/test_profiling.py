@@ -0,0 +1,61 @@
+"""profiling のテスト"""
+
+import cProfile
+import glob
+import json
+import threading
+
+from profiling import Profiler, stage
+
+
+class BusyProfile(cProfile.Profile):
+    """Python 3.12 以降で別の cProfile が有効なときと同じく enable() で ValueError を送出"""
+
+    def enable(self, *args, **kwargs):
+        raise ValueError("Another profiling tool is already active")
+
+
+def test_request_without_tools_records_stages(tmp_path):
+    profiler = Profiler(mode="on", output_dir=str(tmp_path))
+    with profiler.request("assessment"):
+        with stage("parse"):
+            pass
+    record = json.loads(open(tmp_path / "summary.jsonl").read())
+    assert record["kind"] == "assessment"
+    assert "parse" in record["stages_ms"]
+    assert "skipped" not in record
+
+
+def test_busy_cprofile_is_skipped_and_recorded(tmp_path, monkeypatch):
+    monkeypatch.setattr(cProfile, "Profile", BusyProfile)
+    profiler = Profiler(mode="on", tools=["cprofile", "sampling"], output_dir=str(tmp_path), interval_ms=2)
+    with profiler.request("render"):
+        with stage("render"):
+            pass
+    record = json.loads(open(tmp_path / "summary.jsonl").read())
+    assert "cprofile" in record["skipped"]
+    assert not glob.glob(str(tmp_path / "*.prof"))
+    assert glob.glob(str(tmp_path / "*.sample.folded"))
+
+
+def test_concurrent_requests_with_cprofile(tmp_path):
+    profiler = Profiler(mode="on", tools=["cprofile"], output_dir=str(tmp_path))
+    barrier, errors = threading.Barrier(2), []
+
+    def run():
+        try:
+            with profiler.request("assessment"):
+                barrier.wait(timeout=5)
+                with stage("generate"):
+                    sum(range(1000))
+                barrier.wait(timeout=5)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(open(tmp_path / "summary.jsonl").readlines()) == 2
@@ -0,0 +1,56 @@
+"""self_consistency のテスト"""
+
+from self_consistency import aggregate, consistency_caption
+
+
+def candidate(risk, laws=("資金決済法",), recs=("専門家に相談する",)):
+    return {"risk_level": risk, "summary": risk, "laws": list(laws), "reason": risk, "recommendations": list(recs)}
+
+
+def test_tie_is_broken_toward_the_more_severe_level():
+    assert aggregate([candidate("Medium"), candidate("High")])["risk_level"] == "High"
+    assert aggregate([candidate("Low"), candidate("Medium")])["risk_level"] == "Medium"
+    assert aggregate([candidate("Low"), candidate("Low"), candidate("High")])["risk_level"] == "Low"
+
+
+def test_failed_candidates_count_in_k_and_agreement():
+    result = aggregate([candidate("High"), candidate("High"), None, {"risk_level": "Check"}])
+    info = result["consistency"]
+    assert (info["k"], info["valid"]) == (4, 2)
+    assert info["risk_votes"] == {"High": 2}
+    assert info["agreement"] == 0.5
+    assert consistency_caption(result).startswith("🗳️ 4候補中2件が High")
+
+
+def test_all_invalid_candidates_fall_back_to_the_first_one():
+    first = {"risk_level": "Check", "laws": ["-"], "reason": "parse error"}
+    result = aggregate([None, first, {"risk_level": "Check", "reason": "other"}])
+    assert result["reason"] == "parse error"
+    assert result["consistency"] == {"k": 3, "valid": 0, "risk_votes": {}, "agreement": 0.0, "law_agreement": 0.0}
+    assert consistency_caption(result) == "⚠️ 3候補のいずれからも診断結果を読み取れませんでした"
+
+
+def test_law_spellings_are_merged_before_voting():
+    result = aggregate([
+        candidate("High", laws=["個人情報保護法第27条"]),
+        candidate("High", laws=["個情法 第２７条（第三者提供）"]),
+        candidate("High", laws=["銀行法"]),
+    ])
+    assert result["laws"] == ["個人情報保護法第27条"]
+
+
+def test_laws_need_a_strict_majority():
+    result = aggregate([
+        candidate("High", laws=["資金決済法", "銀行法"]),
+        candidate("High", laws=["資金決済法", "銀行法"]),
+        candidate("High", laws=["資金決済法"]),
+        candidate("High", laws=["資金決済法"]),
+    ])
+    # 4候補中2件の銀行法は過半数に届かないため採用しない
+    assert result["laws"] == ["資金決済法"]
+
+
+def test_single_candidate_is_kept_as_is():
+    result = aggregate([candidate("Medium", laws=["下請法第4条"], recs=["書面を交付する"])])
+    assert (result["risk_level"], result["laws"], result["recommendations"]) == ("Medium", ["下請法第4条"], ["書面を交付する"])
+    assert consistency_caption(result) is None